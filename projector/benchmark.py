@@ -0,0 +1,228 @@
+"""
+Benchmarks of graph building and slicing on synthetic programs.
+
+    python benchmark.py [--quick] [--repeat=<n>] [--save=<baseline.json>] [--compare=<baseline.json>]
+
+Every case runs in its own process, which reports the best time of every phase and the peak memory of the process
+after it. --compare exits with 1 if a phase got slower than the baseline by more than --tolerance
+"""
+import ast
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pipe, Process
+
+from projector import GraphBuilder, project_variable, __version__
+from graph_utils import visualize
+from session import AnalysisSession
+from source_text import SourceText
+
+CASES = [
+    # name, statements, depth, alias density, variables
+    ('flat-1k', 1000, 0, 0.0, 20),
+    ('nested-1k', 1000, 4, 0.0, 20),
+    ('aliases-1k', 1000, 2, 0.5, 20),
+    ('flat-10k', 10000, 0, 0.0, 50),
+    ('nested-10k', 10000, 4, 0.2, 50),
+    ('wide-10k', 10000, 2, 0.2, 500),
+    ('aliases-10k', 10000, 2, 0.5, 50),
+]
+QUICK_CASES = [(name.replace('1k', '100'), 100, depth, aliases, variables)
+               for name, statements, depth, aliases, variables in CASES if statements == 1000]
+PHASES = ['parse', 'build', 'project', 'dependencies', 'visualize', 'incremental']
+
+
+def generate_program(statements, depth=2, alias_density=0.2, variables=10, seed=0):
+    """
+    A random program whose graph has statements nodes, over variables variables. if and while blocks are nested up to
+    depth, and alias_density of the assignments create objects, alias them or use their attributes
+    """
+    rnd = random.Random(seed)
+    names = ['v%d' % index for index in xrange(variables)]
+    attributes = ['a', 'b', 'c']
+    lines = []
+
+    def operand():
+        choice = rnd.random()
+        if choice < alias_density / 2:
+            return '%s.%s' % (rnd.choice(names), rnd.choice(attributes))
+        if choice < 0.75:
+            return rnd.choice(names)
+        return str(rnd.randint(0, 9))
+
+    def statement(indent):
+        prefix = '    ' * indent
+        if rnd.random() < alias_density:
+            choice = rnd.random()
+            if choice < 0.3:
+                lines.append('%s%s = Obj()' % (prefix, rnd.choice(names)))
+            elif choice < 0.6:
+                lines.append('%s%s = %s' % (prefix, rnd.choice(names), rnd.choice(names)))
+            else:
+                lines.append('%s%s.%s = %s' % (prefix, rnd.choice(names), rnd.choice(attributes), operand()))
+        elif rnd.random() < 0.5:
+            lines.append('%s%s = %s + %s' % (prefix, rnd.choice(names), operand(), operand()))
+        else:
+            lines.append('%s%s = %s' % (prefix, rnd.choice(names), operand()))
+
+    def block(indent, budget):
+        while budget > 0:
+            if indent < depth and budget > 2 and rnd.random() < 0.2:
+                inner = rnd.randint(1, min(budget - 1, 3 + 20 // (indent + 1)))
+                keyword = rnd.choice(['if', 'if', 'while'])
+                lines.append('%s%s %s < %s:' % ('    ' * indent, keyword, operand(), operand()))
+                block(indent + 1, inner)
+                budget -= inner + 1
+                if keyword == 'if' and budget > 2 and rnd.random() < 0.4:
+                    inner = rnd.randint(1, min(budget - 2, 3 + 20 // (indent + 1)))
+                    lines.append('%selse:' % ('    ' * indent))
+                    block(indent + 1, inner)
+                    budget -= inner + 1
+            else:
+                statement(indent)
+                budget -= 1
+
+    for name in names:
+        lines.append('%s = %d' % (name, rnd.randint(0, 9)))
+    block(0, max(statements - variables, 1))
+    return '\n'.join(lines) + '\n'
+
+
+def run_case(statements, depth, alias_density, variables, repeat=3, seed=0):
+    """
+    {phase: {'seconds': best time, 'peak_kb': peak memory of the process after it}}
+    """
+    code = generate_program(statements, depth, alias_density, variables, seed)
+    names = ['v%d' % index for index in xrange(variables)]
+    edited = code + 'v0 = v1\n'
+    output_directory = tempfile.mkdtemp()
+    state = {}
+
+    def parse():
+        state['module'] = ast.parse(code)
+
+    def build():
+        state['graph'] = GraphBuilder(0, source=SourceText(code))
+        state['graph'].visit(state['module'])
+        state['graph'].source = None
+
+    def project():
+        state['graph'].forget_closures()
+        for name in names:
+            project_variable(state['graph'], name)
+
+    def dependencies():
+        graph = state['graph']
+        graph.forget_closures()
+        dependence = graph.dependence
+        for node in xrange(0, len(graph.nodes), max(len(graph.nodes) // 100, 1)):
+            dependence.closure(node)
+
+    def render():
+        visualize(state['graph'], os.path.join(output_directory, 'out.gv'), max_nodes=None)
+        for name in os.listdir(output_directory):
+            os.remove(os.path.join(output_directory, name))
+
+    def incremental():
+        session = AnalysisSession()
+        session.update(code)
+        started = time.time()
+        session.update(edited)
+        return time.time() - started
+
+    results = {}
+    try:
+        for phase, run in zip(PHASES, [parse, build, project, dependencies, render, incremental]):
+            best = None
+            for _ in xrange(repeat):
+                started = time.time()
+                seconds = run()
+                if seconds is None:
+                    seconds = time.time() - started
+                best = seconds if best is None else min(best, seconds)
+            results[phase] = {'seconds': best, 'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    finally:
+        shutil.rmtree(output_directory)
+    return results
+
+
+def run_case_in_process(case, repeat=3):
+    """
+    Run a case in a process of its own, so its peak memory is its own
+    """
+    receiving, sending = Pipe(False)
+
+    def run():
+        sending.send(run_case(*case[1:], repeat=repeat))
+
+    process = Process(target=run)
+    process.start()
+    results = receiving.recv()
+    process.join()
+    return results
+
+
+def run_benchmarks(cases, repeat=3):
+    results = {'version': __version__, 'python': sys.version.split()[0], 'cases': {}}
+    for case in cases:
+        name, statements, depth, alias_density, variables = case
+        results['cases'][name] = {
+            'parameters': {'statements': statements, 'depth': depth, 'alias_density': alias_density,
+                           'variables': variables},
+            'phases': run_case_in_process(case, repeat)}
+        print_case(name, results['cases'][name]['phases'])
+    return results
+
+
+def print_case(name, phases, baseline=None):
+    cells = []
+    for phase in PHASES:
+        cell = '%s %.4fs' % (phase, phases[phase]['seconds'])
+        if baseline is not None:
+            cell += ' (x%.2f)' % (phases[phase]['seconds'] / max(baseline[phase]['seconds'], 1e-9))
+        cells.append(cell)
+    print '%-12s %s  peak %dKB' % (name, '  '.join(cells), phases[PHASES[-1]]['peak_kb'])
+
+
+def regressions(results, baseline, tolerance=1.25, noise=0.005):
+    """
+    (case, phase, baseline seconds, seconds) of the phases slower than tolerance times the baseline. Differences
+    under noise seconds are ignored
+    """
+    found = []
+    for name, case in sorted(results['cases'].items()):
+        if name not in baseline['cases']:
+            continue
+        for phase in PHASES:
+            seconds = case['phases'][phase]['seconds']
+            baseline_seconds = baseline['cases'][name]['phases'][phase]['seconds']
+            if seconds > baseline_seconds * tolerance and seconds - baseline_seconds > noise:
+                found.append((name, phase, baseline_seconds, seconds))
+    return found
+
+
+def main():
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+    results = run_benchmarks(QUICK_CASES if 'quick' in options else CASES, int(options.get('repeat') or 3))
+
+    if options.get('save'):
+        with file(options['save'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.get('compare'):
+        with file(options['compare']) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, float(options.get('tolerance') or 1.25))
+        for name, phase, baseline_seconds, seconds in found:
+            print 'Regression in %s %s: %.4fs -> %.4fs' % (name, phase, baseline_seconds, seconds)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
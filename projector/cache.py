@@ -0,0 +1,88 @@
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import zlib
+
+from projector import create_graph, __version__
+from stats import timed
+
+
+class GraphCache(object):
+    """
+    Built graphs on disk, one file per source hash and projector version, so a code analysed before isn't parsed and
+    built again. Files are touched when read, and the least recently used ones are evicted once the directory grows
+    beyond max_bytes
+    """
+    SUFFIX = '.graph'
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, code):
+        key = hashlib.sha1(__version__ + '\0')
+        key.update(code)
+        return key.hexdigest()
+
+    def graph(self, code):
+        """
+        The graph of code, built and stored if it isn't in the cache
+        """
+        graph = self.load(code)
+        if graph is None:
+            graph = create_graph(code)
+            self.store(code, graph)
+        return graph
+
+    @timed('cache.load')
+    def load(self, code):
+        path = self._path(code)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:
+            graph = cPickle.loads(zlib.decompress(data))
+        except Exception:   # Written by an older projector or truncated - build it again
+            return None
+        os.utime(path, None)
+        return graph
+
+    @timed('cache.store')
+    def store(self, code, graph):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(cPickle.dumps(graph, cPickle.HIGHEST_PROTOCOL), 1))
+        os.rename(temp_path, self._path(code))
+        self._evict()
+
+    def _path(self, code):
+        return os.path.join(self.directory, self.key(code) + self.SUFFIX)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:     # Evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
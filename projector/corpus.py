@@ -0,0 +1,98 @@
+import os
+import sys
+import traceback
+from multiprocessing import Pool
+
+from projector import create_graph_from_file, project_variable, output_results
+
+
+def find_jobs(corpus, projected_variables=()):
+    """
+    (code_file, name, projected variables) for every python file under the directory corpus, or for every line
+    '<code_file> [<projected_variable> ...]' of the manifest corpus. projected_variables are projected in every file
+    """
+    jobs = []
+    if os.path.isdir(corpus):
+        for directory, directories, files in os.walk(corpus):
+            directories.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    code_file = os.path.join(directory, name)
+                    jobs.append((code_file, os.path.relpath(code_file, corpus), list(projected_variables)))
+    else:
+        base_directory = os.path.dirname(corpus)
+        with file(corpus) as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                jobs.append((os.path.join(base_directory, fields[0]), fields[0], fields[1:] + list(projected_variables)))
+    return jobs
+
+
+def analyse_file(task):
+    """
+    Analyse one file of the corpus into its own output directory. Returns the error instead of raising it, so one bad
+    file doesn't stop the others
+    """
+    code_file, output_directory, projected_variables, cache_directory, output_format, analysis = task
+    try:
+        if cache_directory is None:
+            graph, last_line = create_graph_from_file(code_file)
+        else:
+            from cache import GraphCache
+            with file(code_file) as f:
+                code = f.read()
+            graph = GraphCache(cache_directory).graph(code)
+            last_line = code.rsplit('\n', 1)[-1]
+
+        if not os.path.isdir(output_directory):
+            os.makedirs(output_directory)
+        output_results(graph, lambda var: project_variable(graph, var, var == last_line), projected_variables,
+                       output_directory, graphs=False, output_format=output_format, analysis=analysis)
+    except Exception:
+        return code_file, traceback.format_exc()
+    return code_file, None
+
+
+def analyse_corpus(jobs, output_directory, processes=None, cache_directory=None, output_format='text', analysis=True):
+    """
+    Analyse the jobs on a pool of processes, yields (code_file, error) in the order they finish. error is None if the
+    file was analysed. Without analysis only the projections are written
+    """
+    tasks = [(code_file, os.path.join(output_directory, _output_name(name)), projected_variables, cache_directory,
+              output_format, analysis) for code_file, name, projected_variables in jobs]
+    pool = Pool(processes)
+    try:
+        for result in pool.imap_unordered(analyse_file, tasks):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def run_corpus(corpus, output_directory, projected_variables=(), processes=None, cache_directory=None,
+               output_format='text', analysis=True):
+    """
+    Analyse a corpus, reporting the failed files on stderr. Returns the number of failures
+    """
+    jobs = find_jobs(corpus, projected_variables)
+    failures = 0
+    for code_file, error in analyse_corpus(jobs, output_directory, processes, cache_directory, output_format,
+                                           analysis):
+        if error is not None:
+            failures += 1
+            print >> sys.stderr, 'Failed to analyse %s:%s%s' % (code_file, os.linesep, error)
+    print '%d files analysed, %d failed' % (len(jobs), failures)
+    return failures
+
+
+def _output_name(name):
+    """
+    The output directory of a corpus file, relative to the corpus output directory
+    """
+    parts = os.path.splitext(os.path.normpath(name))[0].split(os.sep)
+    return os.path.join(*[part for part in parts if part not in ('', os.curdir, os.pardir)])
@@ -1,6 +1,9 @@
-import subprocess
-from graphviz import Digraph
-import errno
+# subprocess, threading and filecmp are imported when first used, so importing the module costs next to nothing
+import os
+import sys
+import time
+
+from stats import STATS, timed
 
 
 styles = {
@@ -41,56 +44,159 @@ def apply_styles(graph, styles):
     )
     return graph
 
-def visualize(graph, out_path):
-    visualize_edges(graph, out_path + "_control", True, False)
-    visualize_edges(graph, out_path + "_dep", False, True)
-    visualize_edges(graph, out_path + "_all", True, True)
+MAX_NODES = 2000
+_renders = {}      # DOT file -> the thread rendering it
+
+
+def visualize(graph, out_path, render=False, max_nodes=MAX_NODES, focus=None):
+    """
+    Write the DOT files of the control, the dependency and all the edges. If render, they are laid out by neato in the
+    background and the rendering threads are returned - a file is rendered again only if it changed, and nothing is
+    rendered if neato isn't on the PATH.
+    A graph of more than max_nodes nodes is drawn only around the focus nodes (the projections), and if there are still
+    too many or no focus, with its runs of statements collapsed
+    """
+    shown = runs = None
+    if max_nodes is not None and len(graph.nodes) > max_nodes:
+        if focus:
+            shown = set(focus)
+        if shown is None or len(shown) > max_nodes:
+            runs = straight_line_runs(graph)
+
+    neato = find_executable('neato') if render else None
+    if render and neato is None:
+        print >> sys.stderr, 'neato was not found on the PATH, only the DOT files are written'
+
+    renders = []
+    for out_file, control_edges, dep_edges in [(out_path + "_control", True, False), (out_path + "_dep", False, True),
+                                               (out_path + "_all", True, True)]:
+        changed = visualize_edges(graph, out_file, control_edges, dep_edges, shown, runs)
+        if neato is not None and (changed or not os.path.exists(out_file + '.pdf')):
+            renders.append(render_in_background(neato, out_file))
+    return renders
+
+
+def find_executable(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        for executable in [name, name + '.exe']:
+            path = os.path.join(directory, executable)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return None
+
+
+def render_in_background(neato, out_file):
+    """
+    Lay out a DOT file with neato to a pdf on another thread, after the previous layout of the same file finished
+    """
+    import subprocess
+    import threading
+    previous = _renders.get(out_file)
+
+    def render():
+        if previous is not None:
+            previous.join()
+        cmd = [neato, '-Tpdf', '-O', '-n2', '-Goverlap=false', '-Gsplines=true', out_file]
+        started = time.time()
+        if subprocess.call(cmd) != 0:
+            print >> sys.stderr, 'failed to execute %r' % ' '.join(cmd)
+        if STATS.enabled:
+            STATS.add('render', time.time() - started)
 
+    thread = _renders[out_file] = threading.Thread(target=render)
+    thread.start()
+    return thread
 
-def visualize_edges(graph, out_file, control_edges, dep_edges):
+
+def straight_line_runs(graph):
+    """
+    The first node of the run of statements every node is in - statements of the same block, each only flowing to the
+    next one
+    """
+    nodes = graph.nodes
+    successors = graph.control_edges.successors
+    predecessors = graph.control_edges.predecessors
+    runs = range(len(nodes))
+    for index in xrange(1, len(nodes)):
+        previous = index - 1
+        if nodes.kind(previous) == nodes.kind(index) == nodes.STATEMENT and \
+                nodes.indent(previous) == nodes.indent(index) and \
+                successors.get(previous) == [index] and predecessors.get(index) == [previous]:
+            runs[index] = runs[previous]
+    return runs
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@timed('graphs')
+def visualize_edges(graph, out_file, control_edges, dep_edges, shown=None, runs=None):
+    """
+    Write the DOT file of the graph, every node once and the edges as they are iterated. Only the nodes in shown are
+    drawn if it is given, and a run of statements is drawn as one node if runs (see straight_line_runs) is.
+    Returns False if the file was already written with the same content
+    """
     nodes = graph.nodes
-    dot = Digraph(comment='Graph')
-    #nodes = []
     row_height = 50
     indent_len = 50
     max_height = len(nodes) * row_height
 
-    known_nodes = []
-
     def get_height(row_num):
         return max_height - row_num * row_height
 
-    for edges, is_control in [(graph.control_edges, True), (graph.dep_edges, False)]:
-        for edge in edges:
-            if (is_control and control_edges) or (not is_control and dep_edges):
+    run_ends = {}
+    if runs is not None:
+        for index, first in enumerate(runs):
+            run_ends[first] = index
+
+    def label(index):
+        last = run_ends.get(index, index)
+        lines = [_escape(nodes.statement(index))]
+        if last > index + 1:
+            lines.append('... %d statements ...' % (last - index - 1))
+        if last > index:
+            lines.append(_escape(nodes.statement(last)))
+        return '"%s"' % '\\n'.join(lines)
+
+    written = bytearray(len(nodes))
+    drawn_edges = set()
+    styles = {None: 'color=black', True: 'color=blue', False: 'color=red'}
+    with open(out_file + '.tmp', 'wb') as f:
+        write = f.write
+        write('// Graph\ndigraph {\n')
+        for edges, is_control in [(graph.control_edges, True), (graph.dep_edges, False)]:
+            if not (is_control and control_edges or not is_control and dep_edges):
+                continue
+            for edge in edges:
                 x, y = edge.from_, edge.to
-                # x_node = pydot.Node("Node B", style="filled", fillcolor="green")
-                if x not in known_nodes:
-                    dot.node(str(x), nodes[x].statement, color="black", pos="%d,%d" % (nodes[x].indent * indent_len, get_height(x)))
-                # print nodes[x].statement
-                if y < len(nodes):
-                    if y not in known_nodes:
-                        dot.node(str(y), nodes[y].statement, pos="%d,%d" % (nodes[y].indent * indent_len, get_height(y)))
-                    if not is_control:
-                        dot.edge(str(x), str(y), color="green", style="dashed")
-                    elif edge.jmp_true is None:
-                        dot.edge(str(x), str(y), color="black")
-                    elif edge.jmp_true is True:
-                        dot.edge(str(x), str(y), color="blue")
-                    else:
-                        dot.edge(str(x), str(y), color="red")
-    # apply_styles(dot, styles)
-    dot.engine = "neato"
-    dot.save(out_file, None)
-
-    cmd = "neato.exe -Tpdf -O -n2 -Goverlap=false -Gsplines=true " + out_file
-
-    try:
-        returncode = subprocess.Popen(cmd).wait()
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            raise RuntimeError('failed to execute %r, '
-                'make sure the Graphviz executables '
-                'are on your systems\' path' % cmd)
-        else:
-            raise
+                if shown is not None and (x not in shown or y < len(nodes) and y not in shown):
+                    continue
+                if runs is not None:
+                    x = runs[x]
+                    y = runs[y] if y < len(nodes) else y
+                if not written[x]:
+                    written[x] = 1
+                    write('\t%d [label=%s pos="%d,%d"]\n' % (x, label(x), nodes.indent(x) * indent_len, get_height(x)))
+                if y >= len(nodes) or (runs is not None and x == y):
+                    continue
+                if not written[y]:
+                    written[y] = 1
+                    write('\t%d [label=%s pos="%d,%d"]\n' % (y, label(y), nodes.indent(y) * indent_len, get_height(y)))
+                style = styles[edge.jmp_true] if is_control else 'color=green style=dashed'
+                if runs is not None:
+                    if (x, y, style) in drawn_edges:
+                        continue
+                    drawn_edges.add((x, y, style))
+                write('\t%d -> %d [%s]\n' % (x, y, style))
+        write('}\n')
+
+    import filecmp
+    if os.path.exists(out_file) and filecmp.cmp(out_file + '.tmp', out_file, shallow=False):
+        os.remove(out_file + '.tmp')
+        return False
+    # Replaced at once, a layout still running reads the previous file
+    if os.path.exists(out_file) and os.name == 'nt':
+        os.remove(out_file)
+    os.rename(out_file + '.tmp', out_file)
+    return True
@@ -0,0 +1,238 @@
+from stats import timed
+
+
+def unknown_object(var):
+    """
+    Objects are counted from 0, the unknown object a variable of an outer block points to is negative
+    """
+    return -1 - var
+
+
+def unknown_object_owner(obj):
+    return -1 - obj
+
+
+class PointsTo(object):
+    """
+    The alias domain of a block, indexed both ways - the objects every variable may point to and the variables that
+    may point to every object. An inner block starts empty, pointing to the unknown objects of the variables it uses
+    before assigning, which are resolved when it is merged back.
+    From its first checkpoint on, a domain logs how to undo the changes it makes, so a checkpoint is only a position
+    in the log. Only the state at the checkpoints is ever restored, so between two checkpoints a variable or object is
+    logged the first time it's given a new set, the members added to a set in one change, and a set created after the
+    last checkpoint not at all
+    """
+    def __init__(self, symbols, object_ids=None):
+        self.symbols = symbols
+        self.var_to_object = {}
+        self.object_to_var = {}
+        self._object_ids = [0] if object_ids is None else object_ids     # The next object, shared with the inner blocks
+        self._undo = None   # (mapping, key, the replaced value or None) or (set, the members added to it)
+        self._undo_size = 0
+        self._released = 0  # The changes dropped from the start of the log
+        self._replaced = set()  # (mapping id, key) given a new set since the last checkpoint
+        self._added = {}        # set id -> its change since the last checkpoint
+        self._fresh = {}        # set id -> the sets created since the last checkpoint
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_undo'], state['_undo_size'], state['_released'] = None, 0, 0
+        state['_replaced'], state['_added'], state['_fresh'] = set(), {}, {}
+        return state
+
+    def inner_block(self):
+        return PointsTo(self.symbols, self._object_ids)
+
+    def knows(self, var):
+        return var in self.var_to_object
+
+    def new_object(self, var):
+        """
+        var = Ctor()
+        """
+        obj = self._object_ids[0]
+        self._object_ids[0] += 1
+        self._replace(self.var_to_object, var, set([obj]))
+        self._replace(self.object_to_var, obj, set([var]))
+        return obj
+
+    def assign(self, var, other):
+        """
+        var = other, where other is known. var now points wherever other does
+        """
+        self._replace(self.var_to_object, var, set())
+        for obj in self.var_to_object[other]:
+            self._add(self.object_to_var[obj], var)
+            self.var_to_object[var].add(obj)
+
+    def assign_unknown(self, var, other):
+        """
+        var = other, where other is from an outer block
+        """
+        obj = unknown_object(other)
+        self._replace(self.var_to_object, var, set([obj]))
+        self._replace(self.object_to_var, obj, set([var]))
+
+    def forget(self, var):
+        self._replace(self.var_to_object, var, set())
+
+    @timed('build.aliases')
+    def aliases(self, var):
+        """
+        The other variables that may point to the object var points to
+        """
+        outer_aliases = self.object_to_var.get(unknown_object(var))
+        if outer_aliases is not None:
+            return list(outer_aliases)
+
+        aliases = []
+        seen = set([var])
+        for obj in self.var_to_object.get(var, ()):
+            for other_var in self.object_to_var[obj]:
+                if other_var not in seen:   # Once, however many of the objects it shares with var
+                    seen.add(other_var)
+                    aliases.append(other_var)
+        return aliases
+
+    @timed('build.aliases')
+    def attributes(self, var, defined):
+        """
+        The attributes of var and its aliases that are in defined
+        """
+        attributes = set()
+        for other_var in self.aliases(var) + [var]:
+            for attribute in self.symbols.attributes(other_var):
+                if attribute in defined:
+                    attributes.add(attribute)
+        return attributes
+
+    @timed('build.aliases')
+    def merge(self, inner):
+        """
+        Merge the domain of an inner block. Its unknown objects are resolved to what their variables point to before
+        the merge, so the result doesn't depend on the order the inner variables are merged in
+        """
+        resolved = {}
+        for obj in inner.object_to_var:
+            if obj < 0:
+                resolved[obj] = self._resolve(obj)
+        for objects in inner.var_to_object.itervalues():
+            for obj in objects:
+                if obj < 0 and obj not in resolved:
+                    resolved[obj] = self._resolve(obj)
+
+        for obj, vars in inner.object_to_var.iteritems():
+            for found_object in resolved.get(obj, (obj,)):
+                self._update(self.object_to_var, found_object, vars)
+
+        logging = self._undo is not None
+        for var, objects in inner.var_to_object.iteritems():
+            found_objects = set()
+            for obj in objects:
+                for found_object in resolved.get(obj, (obj,)):
+                    found_objects.add(found_object)
+                    if found_object != obj:
+                        object_vars = self.object_to_var[found_object]
+                        if logging and var not in object_vars:
+                            self._log_added(object_vars, (var,))
+                        object_vars.add(var)
+            self._update(self.var_to_object, var, found_objects)
+
+    def checkpoint(self):
+        if self._undo is None:
+            self._undo = []
+        self._replaced, self._added, self._fresh = set(), {}, {}
+        return self._released + len(self._undo), self._object_ids[0]
+
+    def rollback(self, checkpoint):
+        """
+        Undo the changes made after checkpoint, the latest first
+        """
+        position, self._object_ids[0] = checkpoint
+        undo = self._undo
+        while self._released + len(undo) > position:
+            change = undo.pop()
+            self._undo_size -= _change_size(change)
+            if len(change) == 2:
+                change[0].difference_update(change[1])
+            elif change[2] is None:
+                del change[0][change[1]]
+            else:
+                change[0][change[1]] = change[2]
+        self._replaced, self._added, self._fresh = set(), {}, {}
+
+    def release(self, checkpoint):
+        """
+        Forget how to roll back to before checkpoint
+        """
+        position = checkpoint[0] - self._released
+        for change in self._undo[:position]:
+            self._undo_size -= _change_size(change)
+        del self._undo[:position]
+        self._released = checkpoint[0]
+
+    def undo_size(self):
+        """
+        The objects and variables in the sets the log keeps to roll back to the checkpoints
+        """
+        return self._undo_size
+
+    def size(self):
+        """
+        The objects and variables in the sets of the domain
+        """
+        return sum(map(len, self.var_to_object.itervalues())) + sum(map(len, self.object_to_var.itervalues()))
+
+    def _replace(self, mapping, key, values):
+        if self._undo is not None:
+            if (id(mapping), key) not in self._replaced:
+                self._replaced.add((id(mapping), key))
+                change = (mapping, key, mapping.get(key))
+                self._undo.append(change)
+                self._undo_size += _change_size(change)
+            self._fresh[id(values)] = values
+        mapping[key] = values
+
+    def _add(self, values, value):
+        if self._undo is not None and value not in values:
+            self._log_added(values, (value,))
+        values.add(value)
+
+    def _update(self, mapping, key, values):
+        """
+        Add the set values to the set of key in mapping
+        """
+        existing = mapping.get(key)
+        if existing is None:
+            self._replace(mapping, key, set(values))
+        else:
+            if self._undo is not None and id(existing) not in self._fresh and not values <= existing:
+                self._log_added(existing, values - existing)
+            existing.update(values)
+
+    def _log_added(self, values, added):
+        """
+        Log the members added to a set there was at the last checkpoint, all those of a set in one change
+        """
+        if id(values) in self._fresh:
+            return
+        logged = self._added.get(id(values))
+        if logged is None:
+            logged = self._added[id(values)] = set()
+            self._undo.append((values, logged))
+        self._undo_size -= len(logged)
+        logged.update(added)
+        self._undo_size += len(logged)
+
+    def _resolve(self, obj):
+        """
+        The objects an unknown object of an inner block stands for, itself if its variable is unknown here too
+        """
+        objects = self.var_to_object.get(unknown_object_owner(obj))
+        if objects is None:
+            return (obj,)
+        return tuple(objects)
+
+
+def _change_size(change):
+    return len(change[1]) if len(change) == 2 else len(change[2] or ())
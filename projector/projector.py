@@ -1,13 +1,26 @@
 import ast
+import gc
+import mmap
 import os
+import re
 import sys
-import uuid
-import astor
+import time
+from array import array
 
-from graph_utils import visualize
+from graph_utils import visualize, MAX_NODES
+from points_to import PointsTo
+from reachability import ReachabilityIndex, iter_bits
+from source_text import SourceText
+from stats import STATS, timed, graph_metrics
+from symbols import SymbolTable
+
+__version__ = '1.1'
+CHUNK_SIZE = 1 << 20
 
 
 class Edge(object):
+    __slots__ = ('from_', 'to', 'jmp_true')
+
     def __init__(self, from_, to, jmp_true=None):
         self.from_ = from_
         self.to = to
@@ -26,11 +39,145 @@ class Edge(object):
         return other.from_ > self.from_ or (other.from_ == self.from_ and other.to > self.to)
 
 
+class EdgeSet(object):
+    """
+    Edges as int pairs in insertion order, indexed by (from, to) and by target. Adding an existing edge is a no-op.
+    Iterating yields Edge views
+    """
+    _JUMPS = {None: 0, True: 1, False: 2}
+    _JUMP_VALUES = (None, True, False)
+    _REMOVED = -1
+
+    def __init__(self, edges=()):
+        self._from = array('l')
+        self._to = array('l')
+        self._jump = array('b')
+        self._index = {}
+        self._by_target = {}
+        self._removed = 0
+        self._successors = None
+        self._predecessors = None
+        for edge in edges:
+            self.append(edge)
+
+    def __getstate__(self):
+        return self._from.tostring(), self._to.tostring(), self._jump.tostring()
+
+    def __setstate__(self, state):
+        self.__init__()
+        for column, data in zip((self._from, self._to, self._jump), state):
+            column.fromstring(data)
+        for position, jump in enumerate(self._jump):
+            if jump == self._REMOVED:
+                self._removed += 1
+            else:
+                self._index[(self._from[position], self._to[position])] = position
+                self._by_target.setdefault(self._to[position], []).append(position)
+
+    def __iter__(self):
+        for position, jump in enumerate(self._jump):
+            if jump != self._REMOVED:
+                yield Edge(self._from[position], self._to[position], self._JUMP_VALUES[jump])
+
+    def __len__(self):
+        return len(self._jump) - self._removed
+
+    def __contains__(self, edge):
+        return (edge.from_, edge.to) in self._index
+
+    def __repr__(self):
+        return '[%s]' % ', '.join('(%s, %s)' % pair for pair in self.pairs())
+
+    def pairs(self):
+        for position, jump in enumerate(self._jump):
+            if jump != self._REMOVED:
+                yield self._from[position], self._to[position]
+
+    def append(self, edge):
+        return self.add(edge.from_, edge.to, edge.jmp_true)
+
+    def add(self, from_, to, jmp_true=None):
+        key = (from_, to)
+        if key in self._index:
+            return False
+        position = self._index[key] = len(self._jump)
+        self._from.append(from_)
+        self._to.append(to)
+        self._jump.append(self._JUMPS[jmp_true])
+        self._by_target.setdefault(to, []).append(position)
+        self._invalidate()
+        return True
+
+    def pointing_to(self, to):
+        return [self._from[position] for position in self._by_target.get(to, ())]
+
+    def redirect(self, from_, to, new_to):
+        position = self._index.pop((from_, to))
+        self._by_target[to].remove(position)
+        key = (from_, new_to)
+        if key in self._index:     # Already there - drop the duplicate
+            self._jump[position] = self._REMOVED
+            self._removed += 1
+        else:
+            self._to[position] = new_to
+            self._index[key] = position
+            self._by_target.setdefault(new_to, []).append(position)
+        self._invalidate()
+
+    def checkpoint(self):
+        return len(self._jump)
+
+    def rollback(self, checkpoint):
+        """
+        Drop the edges added after checkpoint
+        """
+        for position in xrange(len(self._jump) - 1, checkpoint - 1, -1):
+            if self._jump[position] == self._REMOVED:
+                self._removed -= 1
+            else:
+                del self._index[(self._from[position], self._to[position])]
+                self._by_target[self._to[position]].remove(position)
+        del self._from[checkpoint:]
+        del self._to[checkpoint:]
+        del self._jump[checkpoint:]
+        self._invalidate()
+
+    @property
+    def successors(self):
+        """
+        from -> [to, ...] in edge order
+        """
+        if self._successors is None:
+            self._build_adjacency()
+        return self._successors
+
+    @property
+    def predecessors(self):
+        """
+        to -> [from, ...] in edge order
+        """
+        if self._predecessors is None:
+            self._build_adjacency()
+        return self._predecessors
+
+    def _build_adjacency(self):
+        self._successors = {}
+        self._predecessors = {}
+        for from_, to in self.pairs():
+            self._successors.setdefault(from_, []).append(to)
+            self._predecessors.setdefault(to, []).append(from_)
+
+    def _invalidate(self):
+        self._successors = self._predecessors = None
+
+
 class Node(object):
-    pass
+    __slots__ = ()
 
 
 class StatementNode(Node):
+    __slots__ = ('statement', 'assigned_var', 'influence_vars', 'indent')
+
     def __init__(self, statement, assigned_var, indent, influence_vars=[]):
         self.statement = statement
         self.assigned_var = assigned_var
@@ -45,6 +192,8 @@ class StatementNode(Node):
 
 
 class ControlNode(Node):
+    __slots__ = ('statement', 'checked_vars', 'indent')
+
     def __init__(self, statement, checked_vars, indent):
         self.statement = statement
         self.checked_vars = checked_vars
@@ -54,22 +203,276 @@ class ControlNode(Node):
         return "%s\t%s" % (str(self.checked_vars).ljust(20), self.statement)
 
 
+class NodeTable(object):
+    """
+    Column storage for the graph nodes - kinds, indents and variable symbols in arrays and the statements as offsets
+    into one text buffer. Indexing builds a StatementNode/ControlNode view. Phi nodes have no row, only negative ids
+    """
+    STATEMENT, CONTROL, ELSE = 0, 1, 2
+    _COLUMNS = ('_kinds', '_indents', '_assigned', '_vars', '_vars_end', '_text', '_text_end')
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self._kinds = array('b')
+        self._indents = array('i')
+        self._assigned = array('l')
+        self._vars = array('l')
+        self._vars_end = array('l')
+        self._text = array('c')
+        self._text_end = array('l')
+        self._assigning = {}    # symbol -> the statements assigning to it, in order
+        self.phis = 0
+
+    def __getstate__(self):
+        return self.symbols, [getattr(self, column).tostring() for column in self._COLUMNS], self.phis
+
+    def __setstate__(self, state):
+        symbols, columns, phis = state
+        self.__init__(symbols)
+        for column, data in zip(self._COLUMNS, columns):
+            getattr(self, column).fromstring(data)
+        for index, symbol in enumerate(self._assigned):
+            if symbol >= 0:
+                self._assigning.setdefault(symbol, []).append(index)
+        self.phis = phis
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def __iter__(self):
+        for index in xrange(len(self._kinds)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._kinds)
+        kind = self._kinds[index]
+        if kind == self.STATEMENT:
+            return StatementNode(self.statement(index), self.symbols.name(self._assigned[index]), self._indents[index],
+                                 set(self.variables(index)))
+        elif kind == self.CONTROL:
+            return ControlNode(self.statement(index), self.variables(index), self._indents[index])
+        return ControlNode('else:', '', self._indents[index])
+
+    def add_statement(self, statement, assigned_var, indent, influence_vars):
+        self._add(self.STATEMENT, statement, assigned_var, indent, influence_vars)
+
+    def add_control(self, statement, checked_vars, indent):
+        self._add(self.CONTROL, statement, -1, indent, checked_vars)
+
+    def add_else(self, indent):
+        self._add(self.ELSE, '', -1, indent, ())
+
+    def add_phi(self):
+        self.phis += 1
+        return -self.phis
+
+    def kind(self, index):
+        return self._kinds[index]
+
+    def assigned_var(self, index):
+        if self._kinds[index] != self.STATEMENT:
+            return None
+        return self.symbols.name(self._assigned[index])
+
+    def indent(self, index):
+        return self._indents[index]
+
+    def statement(self, index):
+        if self._kinds[index] == self.ELSE:
+            return 'else:'
+        start = self._text_end[index - 1] if index else 0
+        return self._text[start:self._text_end[index]].tostring()
+
+    def variables(self, index):
+        start = self._vars_end[index - 1] if index else 0
+        return [self.symbols.name(symbol) for symbol in self._vars[start:self._vars_end[index]]]
+
+    def assigned_variables(self):
+        """
+        The names of the variables the statements assign to, attributes left out, in the order first assigned
+        """
+        symbols = self.symbols
+        assigned = []
+        seen = set([symbols.find_variable('')])
+        for symbol in self._assigned:
+            if symbol not in seen:
+                seen.add(symbol)
+                if symbol >= 0 and not symbols.is_attribute(symbol):
+                    assigned.append(symbols.name(symbol))
+        return assigned
+
+    def assigning(self, symbols):
+        """
+        The statements assigning to one of symbols
+        """
+        return sorted(index for symbol in set(symbols) for index in self._assigning.get(symbol, ()))
+
+    def checkpoint(self):
+        return len(self._kinds)
+
+    def rollback(self, checkpoint, phis):
+        """
+        Drop the nodes added after checkpoint, keeping the ids of the first phis phis
+        """
+        self.phis = phis
+        for symbol in self._assigned[checkpoint:]:
+            if symbol >= 0:
+                self._assigning[symbol].pop()
+        del self._vars[self._vars_end[checkpoint - 1] if checkpoint else 0:]
+        del self._text[self._text_end[checkpoint - 1] if checkpoint else 0:]
+        for column in (self._kinds, self._indents, self._assigned, self._vars_end, self._text_end):
+            del column[checkpoint:]
+
+    def _add(self, kind, statement, assigned, indent, variables):
+        self._kinds.append(kind)
+        self._indents.append(indent)
+        self._assigned.append(assigned)
+        if assigned >= 0:
+            self._assigning.setdefault(assigned, []).append(len(self._kinds) - 1)
+        self._vars.extend(variables)
+        self._vars_end.append(len(self._vars))
+        self._text.fromstring(statement)
+        self._text_end.append(len(self._text))
+
+
 class GraphBuilder(ast.NodeVisitor):
-    def __init__(self, indent_level):
-        self.nodes = []
-        self.dep_edges = []
-        self.control_edges = []
-        self.last_seen = {}
+    def __init__(self, indent_level, first_line=0, parent=None, controllers=(), source=None):
+        """
+        Inner blocks are visited by a child builder sharing the parent's nodes and edges, counting lines from first_line.
+        controllers are the control nodes every node of the block depends on. source is the SourceText of the visited
+        code, the text of the nodes is generated from the AST without it.
+        The data dependencies are kept in SSA form - ssa_edges connect every use to the one definition of each variable
+        reaching it, where a phi node (a negative id) joins the definitions that reach the end of an if or the head of a
+        while. dep_edges is the same graph with the phis left out, every use connected to the statements they join
+        """
+        if parent is None:
+            self.source = source
+            self.symbols = SymbolTable()
+            self.points_to = PointsTo(self.symbols)
+            self.nodes = NodeTable(self.symbols)
+            self.control_dependence = []
+            self.ssa_edges = EdgeSet()
+            self.control_edges = EdgeSet()
+        else:
+            self.source = parent.source
+            self.symbols = parent.symbols
+            self.points_to = parent.points_to.inner_block()
+            self.nodes = parent.nodes
+            self.control_dependence = parent.control_dependence
+            self.ssa_edges = parent.ssa_edges
+            self.control_edges = parent.control_edges
+        self._controllers = controllers
+        self._dependence = None
+        self._dependence_version = None
+        self._kept_closures = {}
+        self._dep_edges = None
+        self.last_seen = {}     # variable -> the line or phi defining it here
         self.unknown_vars = {}
-        self.var_to_object = {}
-        self.object_to_var = {}
-        self._code_line = 0
+        self._first_line = first_line
+        self._code_line = first_line
         self.indent_level = indent_level
         super(GraphBuilder, self).__init__()
 
+    def __getstate__(self):
+        """
+        The memoized closures and dep_edges are left out, they are computed again when first used
+        """
+        state = self.__dict__.copy()
+        state['_dependence'] = state['_dependence_version'] = state['_dep_edges'] = None
+        state['_kept_closures'] = {}
+        return state
+
     @property
     def code_length(self):
-        return self._code_line
+        return self._code_line - self._first_line
+
+    @property
+    def dependence(self):
+        """
+        Memoized closures over the data and the control dependencies of the nodes
+        """
+        version = (len(self.nodes), len(self.ssa_edges))
+        if self._dependence_version != version:
+            predecessors = _contract_phis(self.ssa_edges, self.nodes.phis, set(self.last_seen.itervalues()))
+            for node, controllers in enumerate(self.control_dependence):
+                if controllers:
+                    predecessors.setdefault(node, []).extend(controllers)
+            self._dependence = ReachabilityIndex(predecessors, self._kept_closures)
+            self._dependence_version = version
+        return self._dependence
+
+    def forget_closures(self):
+        """
+        Drop the memoized closures, they are computed again from scratch when next used
+        """
+        self._dependence = self._dependence_version = None
+        self._kept_closures = {}
+
+    @property
+    def dep_edges(self):
+        """
+        The data dependencies between the nodes - ssa_edges with every phi replaced by the definitions it joins
+        """
+        if self._dep_edges is None or self._dep_edges[0] != len(self.ssa_edges):
+            self._dep_edges = (len(self.ssa_edges), _without_phis(self.ssa_edges))
+        return self._dep_edges[1]
+
+    def checkpoint(self):
+        """
+        The state of a top level builder between two statements, to roll back to when the code after them changes. The
+        uses of unknown variables are only ever appended to at the top level, so their lengths are enough
+        """
+        return (self.nodes.checkpoint(), self.nodes.phis, self.ssa_edges.checkpoint(), self.control_edges.checkpoint(),
+                self.symbols.checkpoint(), self.points_to.checkpoint(), self._code_line,
+                dict(self.last_seen), dict((var, len(lines)) for var, lines in self.unknown_vars.iteritems()))
+
+    def rollback(self, checkpoint):
+        """
+        Forget the statements visited after checkpoint. The closures of the nodes before it can't change, since later
+        statements never add dependencies to them, so they are kept
+        """
+        nodes, phis, ssa_edges, control_edges, symbols, points_to, self._code_line, last_seen, unknown_vars = checkpoint
+        if self._dependence is not None:
+            self._kept_closures = self._dependence.closures_before(nodes)
+        else:
+            self._kept_closures = dict(item for item in self._kept_closures.iteritems() if 0 <= item[0] < nodes)
+        self._dependence = self._dependence_version = self._dep_edges = None
+
+        self.nodes.rollback(nodes, phis)
+        del self.control_dependence[nodes:]
+        self.ssa_edges.rollback(ssa_edges)
+        self.control_edges.rollback(control_edges)
+        self.symbols.rollback(symbols)
+        self.points_to.rollback(points_to)
+        self.last_seen = dict(last_seen)
+        for var in self.unknown_vars.keys():
+            if var in unknown_vars:
+                del self.unknown_vars[var][unknown_vars[var]:]
+            else:
+                del self.unknown_vars[var]
+
+    def release(self, checkpoint):
+        """
+        Forget what only rolling back to before checkpoint needs
+        """
+        self.points_to.release(checkpoint[5])
+
+    def visit_body(self, body):
+        for statement in body:
+            self.visit(statement)
+
+    def query_dependencies(self, expression):
+        """
+        The lines and phis an expression statement appended after the code would depend on, without appending it. The
+        names it interns are forgotten after, a name the code doesn't have has no dependencies
+        """
+        interned = self.symbols.checkpoint()
+        try:
+            influence_vars, _ = self._find_influence_vars(ast.parse(expression).body[0].value, self.symbols.variable(''))
+            return set(self.last_seen[var] for var in influence_vars if var in self.last_seen)
+        finally:
+            self.symbols.rollback(interned)
 
     def visit_Expr(self, node):
         self._handle_statement(node, False)
@@ -80,21 +483,24 @@ class GraphBuilder(ast.NodeVisitor):
     def visit_If(self, node):
         block_starting_line = self._code_line
 
-        self._create_condition_dependencies(node)
+        self._create_dep_edge(self._add_condition(node), block_starting_line)
 
         # Then part
-        self.control_edges.append(Edge(block_starting_line, self._code_line + 1, jmp_true=True))
-        last_seen_then_part, then_code_length = self._build_and_merge_inner_graph(node.body)
+        self.control_edges.add(block_starting_line, self._code_line + 1, jmp_true=True)
+        then_graph = self._build_and_merge_inner_graph(node.body, (block_starting_line,))
+        last_seen_then_part, then_code_length = then_graph.last_seen, then_graph.code_length
 
         if node.orelse:
             self._code_line += 1
-            self.nodes.append(ControlNode('else:', '', self.indent_level))
-            self.control_edges.append(Edge(block_starting_line, self._code_line + 1, jmp_true=False))
-            last_seen_else_part, else_code_length = self._build_and_merge_inner_graph(node.orelse)
+            self.nodes.add_else(self.indent_level)
+            self._record_control_dependence((block_starting_line,))
+            self.control_edges.add(block_starting_line, self._code_line + 1, jmp_true=False)
+            else_graph = self._build_and_merge_inner_graph(node.orelse, (block_starting_line, self._code_line))
+            last_seen_else_part, else_code_length = else_graph.last_seen, else_graph.code_length
             self._fix_control_edges_that_point_to_the_end_of_block(block_starting_line, block_starting_line + then_code_length,
                                                                    block_starting_line + then_code_length + else_code_length + 2)
         else:
-            self.control_edges.append(Edge(block_starting_line, block_starting_line + then_code_length + 1))
+            self.control_edges.add(block_starting_line, block_starting_line + then_code_length + 1)
             last_seen_else_part = {}
         self._merge_last_seen(last_seen_then_part, last_seen_else_part)
 
@@ -103,28 +509,36 @@ class GraphBuilder(ast.NodeVisitor):
     def visit_While(self, node):
         block_starting_line = self._code_line
 
-        self.control_edges.append(Edge(block_starting_line, self._code_line + 1, jmp_true=True))
-
-        # First iteration
-        control_node = self._create_condition_dependencies(node)
-        last_seen_inner, loop_code_length = self._build_and_merge_inner_graph(node.body)
-        self._merge_last_seen(last_seen_inner, {})
-
-        # Any other iteration
-        code = ''
-        for statement in node.body:
-            code += astor.codegen.to_source(statement) + os.linesep
-        inner_graph = create_graph(code, self.indent_level + 1)
-        self._find_unknown_variables(inner_graph.unknown_vars, block_starting_line)
-        self._create_condition_dependencies(node, block_starting_line, control_node)
-        self._fix_inner_code_lines(inner_graph.last_seen, block_starting_line)
-        self._merge_last_seen(inner_graph.last_seen, {})
+        self.control_edges.add(block_starting_line, self._code_line + 1, jmp_true=True)
+
+        checked_vars = self._add_condition(node)
+        inner_graph = self._build_inner_graph(node.body, (block_starting_line,))
+        loop_code_length = inner_graph.code_length
+
+        # The condition and the body's uses of variables from before the loop read, on any iteration, what reached the
+        # loop or what the body assigned. Those the body assigns read a phi at the loop's head, joining the body's
+        # definition with what reaches the loop - which is also what the variable is after the loop
+        uses = _copy_lists(inner_graph.unknown_vars)
+        for var in checked_vars:
+            uses.setdefault(var, []).append(block_starting_line)
+        last_seen_body = dict(inner_graph.last_seen)
+        for var in [var for var in uses if var in last_seen_body]:
+            head = self._add_phi([last_seen_body[var]])
+            for line in uses.pop(var):
+                self.ssa_edges.add(head, line)
+            reached = var in self.last_seen
+            self._create_dep_edge([var], head)     # Or the head is left unknown, like the uses would be
+            if reached:
+                self.last_seen[var] = head
+                del last_seen_body[var]
+        self._find_unknown_variables(uses)
+        self._merge_last_seen(last_seen_body, {})
 
         # Add and Fix edges
-        self._fix_control_edges_that_point_to_the_end_of_block(block_starting_line, block_starting_line + inner_graph.code_length, block_starting_line)
+        self._fix_control_edges_that_point_to_the_end_of_block(block_starting_line, block_starting_line + loop_code_length, block_starting_line)
 
         # self.control_edges.append(Edge(block_starting_line + loop_code_length, block_starting_line))
-        self.control_edges.append(Edge(block_starting_line, block_starting_line + loop_code_length + 1))
+        self.control_edges.add(block_starting_line, block_starting_line + loop_code_length + 1)
 
         self._code_line += 1
 
@@ -132,353 +546,448 @@ class GraphBuilder(ast.NodeVisitor):
         """
         If mekunan fixes - edges the points from the if to else
         """
-        for edge in self.control_edges:
-            if edge.from_ > block_starting_line and edge.to == block_end_line + 1:
-                edge.to = right_pointing_line
+        for from_ in self.control_edges.pointing_to(block_end_line + 1):
+            if from_ > block_starting_line:
+                self.control_edges.redirect(from_, block_end_line + 1, right_pointing_line)
 
     def _merge_last_seen(self, last_seen_then, last_seen_else):
-        for var in set(last_seen_then.keys() + last_seen_else.keys()):
-            if var in last_seen_then and var in last_seen_else or var not in self.last_seen:
-                fixed_locations = []
-                if var in last_seen_then:
-                    fixed_locations.extend(last_seen_then[var])
-                if var in last_seen_else:
-                    fixed_locations.extend(last_seen_else[var])
-                self.last_seen[var] = fixed_locations
-            elif var in last_seen_then:
-                self.last_seen[var].extend(last_seen_then[var])
+        """
+        A variable assigned in both branches is defined after the block by a phi of their definitions, one assigned in a
+        single branch by a phi of its definition and the one that reached the block, if any
+        """
+        for var, line in last_seen_then.iteritems():
+            if var in last_seen_else:
+                self.last_seen[var] = self._add_phi([line, last_seen_else[var]])
             else:
-                self.last_seen[var].extend(last_seen_else[var])
-            self.last_seen[var] = list(set(self.last_seen[var]))
+                self._join_definition(var, line)
+        for var, line in last_seen_else.iteritems():
+            if var not in last_seen_then:
+                self._join_definition(var, line)
+
+    def _join_definition(self, var, line):
+        if var in self.last_seen:
+            self.last_seen[var] = self._add_phi([self.last_seen[var], line])
+        else:
+            self.last_seen[var] = line
+
+    def _add_phi(self, definitions):
+        phi = self.nodes.add_phi()
+        for line in definitions:
+            self.ssa_edges.add(line, phi)
+        return phi
 
     def _handle_statement(self, node, update_last_seen=True):
         # Find target
-        target = ''
+        target = self.symbols.variable('')
         if isinstance(node, ast.Assign):
             if isinstance(node.targets[0], ast.Name):   # Assign to variable
-                target = node.targets[0].id
+                target = self.symbols.variable(node.targets[0].id)
             else:   # Assign to attribute
-                target = node.targets[0].value.id + '#' + node.targets[0].attr
+                target = self.symbols.attribute(self.symbols.variable(node.targets[0].value.id), node.targets[0].attr)
 
         self._create_statement_dependencies(node, target)
-        self.control_edges.append(Edge(self._code_line, self._code_line+1))
+        self.control_edges.add(self._code_line, self._code_line+1)
         if update_last_seen:
-            self.last_seen[target] = [self._code_line]
+            self.last_seen[target] = self._code_line
         self._code_line += 1
 
     def _create_dep_edge(self, influence_vars, to):
         for var in influence_vars:
             if var in self.last_seen:
-                for code_line in self.last_seen[var]:
-                    edge = Edge(code_line, to)
-                    if edge not in self.dep_edges:
-                        self.dep_edges.append(edge)
+                self.ssa_edges.add(self.last_seen[var], to)
+            elif var in self.unknown_vars:
+                self.unknown_vars[var].append(to)
             else:
-                if var in self.unknown_vars:
-                    self.unknown_vars[var].append(self._code_line)
-                else:
-                    self.unknown_vars[var] = [self._code_line]
+                self.unknown_vars[var] = [to]
 
     def _create_statement_dependencies(self, node, target):
         """
         Find the dependency of the assign node and create an edge if possible, otherwise - append the dependency to unknown
         """
-        code = astor.codegen.to_source(node)
+        code = self.source.statement(node) if self.source is not None else None
+        if code is None:
+            code = _to_source(node)
+        influence_vars, assigned_var = self._find_influence_vars(node.value, target)
+
+        self.nodes.add_statement(code, target, self.indent_level, influence_vars)
+        self._record_control_dependence()
+        self._create_dep_edge(influence_vars, self._code_line)
 
-        # Find the variables that influence on me variable dependencies
+        # Update the abstract domain
+        if isinstance(node.value, ast.Call):      # Call to ctor
+            self.points_to.new_object(target)
+        if isinstance(node, ast.Assign):
+            if isinstance(node.value, ast.Name) or isinstance(node.value, ast.Attribute):
+                if self.points_to.knows(assigned_var):
+                    self.points_to.assign(target, assigned_var)
+                elif assigned_var not in self.last_seen:   # We don't know the assigned object it probably from higher level
+                    self.points_to.assign_unknown(target, assigned_var)
+            elif isinstance(node.value, ast.Num):
+                self.points_to.forget(target)
+
+    def _find_influence_vars(self, value, target):
+        """
+        Find the variables that influence on the value assigned to target. Doesn't change the builder, but for interning
+        the names
+        """
+        symbols = self.symbols
+        assigned_var = None
         influence_vars = set()
-        if isinstance(node.value, ast.BinOp):
-            for inner_disassembly in [node.value.right, node.value.left]:
+        if isinstance(value, ast.BinOp):
+            for inner_disassembly in [value.right, value.left]:
                 if isinstance(inner_disassembly, ast.Name):
-                    influence_vars.add(inner_disassembly.id)
+                    influence_vars.add(symbols.variable(inner_disassembly.id))
                 elif isinstance(inner_disassembly, ast.Attribute):
-                    influence_name = inner_disassembly.value.id
+                    influence_name = symbols.variable(inner_disassembly.value.id)
                     influence_attribute = inner_disassembly.attr
-                    influence_var_with_attribute = influence_name + '#' + influence_attribute
+                    influence_var_with_attribute = symbols.find_attribute(influence_name, influence_attribute)
                     if influence_var_with_attribute in self.last_seen:
                         influence_vars.add(influence_var_with_attribute)
                     else:
-                        for var in self._get_vars_that_points_to_the_same_object(influence_name):
-                            other_var_with_attribute = var + '#' + influence_attribute
+                        for var in self.points_to.aliases(influence_name):
+                            other_var_with_attribute = symbols.find_attribute(var, influence_attribute)
                             if other_var_with_attribute in self.last_seen:
                                 influence_vars.add(other_var_with_attribute)
                                 break
-        elif isinstance(node.value, ast.Name):
-            assigned_var = node.value.id
+        elif isinstance(value, ast.Name):
+            assigned_var = symbols.variable(value.id)
             influence_vars.add(assigned_var)
-            influence_vars = influence_vars.union(self._find_attributes_of_the_same_object(assigned_var))
-        elif isinstance(node.value, ast.Call):      # Call to ctor
-            obj = '#' + str(uuid.uuid4()) + '#' + node.value.func.id
-            self.var_to_object[target] = set([obj])
-            self.object_to_var[obj] = set([target])
-        elif isinstance(node.value, ast.Attribute):
-            influence_name = node.value.value.id
-            influence_attribute = node.value.attr
-            assigned_var = influence_name + '#' + influence_attribute
+            influence_vars = influence_vars.union(self.points_to.attributes(assigned_var, self.last_seen))
+        elif isinstance(value, ast.Attribute):
+            influence_name = symbols.variable(value.value.id)
+            influence_attribute = value.attr
+            assigned_var = symbols.attribute(influence_name, influence_attribute)
             if assigned_var in self.last_seen:
                 influence_vars.add(assigned_var)
-                influence_vars = influence_vars.union(self._find_attributes_of_the_same_object(assigned_var))
+                influence_vars = influence_vars.union(self.points_to.attributes(assigned_var, self.last_seen))
             else:
-                vars_pointing_to_the_same_element = self._get_vars_that_points_to_the_same_object(influence_name)
+                vars_pointing_to_the_same_element = self.points_to.aliases(influence_name)
                 if not vars_pointing_to_the_same_element:   # We don't know this pointing, maybe it's from higher level
                     influence_vars.add(assigned_var)
                 else:
                     influence_vars.add(influence_name)      # Add the assignment to other variable
                     for var in vars_pointing_to_the_same_element:   # Search for corresponding attribute
-                        other_var_with_attribute = var + '#' + influence_attribute
+                        other_var_with_attribute = symbols.find_attribute(var, influence_attribute)
                         if other_var_with_attribute in self.last_seen:
                             influence_vars.add(other_var_with_attribute)
-                            influence_vars = influence_vars.union(self._find_attributes_of_the_same_object(other_var_with_attribute))
+                            influence_vars = influence_vars.union(self.points_to.attributes(other_var_with_attribute, self.last_seen))
                             break
 
         # If the target is attribute, the object declaration is also influence
-        if '#' in target:
-            name, attribute = target.split('#')
-            influence_vars.add(name)
+        if symbols.is_attribute(target):
+            influence_vars.add(symbols.base(target))
 
-        self.nodes.append(StatementNode(code, target, self.indent_level, influence_vars))
-        self._create_dep_edge(influence_vars, self._code_line)
+        return influence_vars, assigned_var
 
-        # Update the abstract domain
-        if isinstance(node, ast.Assign):
-            if isinstance(node.value, ast.Name) or isinstance(node.value, ast.Attribute):
-                if assigned_var in self.var_to_object:
-                    self.var_to_object[target] = set()
-                    for obj in self.var_to_object[assigned_var]:
-                        self.object_to_var[obj].add(target)
-                        self.var_to_object[target].add(obj)
-                elif assigned_var not in self.last_seen:   # We don't know the assigned object it probably from higher level
-                    object_name = '@DONT_KNOW@' + assigned_var
-                    self.var_to_object[target] = set([object_name])
-                    self.object_to_var[object_name] = set([target])
-            elif isinstance(node.value, ast.Num):
-                self.var_to_object[target] = set()
-
-    def _find_attributes_of_the_same_object(self, var_name):
-        return_list = []
-        for other_var in self._get_vars_that_points_to_the_same_object(var_name) + [var_name]:
-            for tmp_var in self.last_seen.keys():
-                if other_var + '#' in tmp_var and other_var == tmp_var.rsplit('#', 1)[0]:
-                    return_list.append(tmp_var)
-        return set(return_list)
-
-    def _get_vars_that_points_to_the_same_object(self, var):
-        return_list = []
-
-        for obj in self.object_to_var:
-            if '@DONT_KNOW@' + var == obj:
-                return list(self.object_to_var[obj])
-
-        if var in self.var_to_object:
-            for obj in self.var_to_object[var]:
-                for other_var in self.object_to_var[obj]:
-                    return_list.append(other_var)
-
-        # if '#' in var:
-        #     name, attr = var.split('#')
-        #     for other_var in self._get_vars_that_points_to_the_same_object(name):
-        #         possible_match = other_var + '#' + attr
-        #         if possible_match in self.last_seen:
-        #             return_list.append(possible_match)
-
-        while var in return_list:
-            return_list.remove(var)
-
-        return return_list
-
-    def _create_condition_dependencies(self, node, code_line=None, control_node=None):
-        if isinstance(node, ast.If):
-            code = astor.codegen.to_source(ast.If(test=node.test, body=[], orelse=[]))
-        else:   # While
-            code = astor.codegen.to_source(ast.While(test=node.test, body=[], orelse=[]))
+    def _add_condition(self, node):
+        """
+        Add the node of an if or while condition, returns the variables it checks
+        """
         checked_vars = []
         for tested in [node.test.left, node.test.comparators[0]]:
             if isinstance(tested, ast.Name):
-                checked_vars.append(tested.id)
+                checked_vars.append(self.symbols.variable(tested.id))
             elif isinstance(tested, ast.Attribute):
-                checked_vars.append(tested.value.id + '#' + tested.attr)
-        self._create_dep_edge(checked_vars, self._code_line if not code_line else code_line)
-        if not control_node:
-            control_node = ControlNode(code, checked_vars, self.indent_level)
-            self.nodes.append(control_node)
-        return control_node
-
-    def _build_and_merge_inner_graph(self, body):
-        code = ''
-        for statement in body:
-            code += astor.codegen.to_source(statement) + os.linesep
-        inner_graph = create_graph(code, self.indent_level + 1)
+                checked_vars.append(self.symbols.attribute(self.symbols.variable(tested.value.id), tested.attr))
+        code = self.source.header(node) if self.source is not None else None
+        if code is None:
+            code = _to_source(type(node)(test=node.test, body=[], orelse=[]))
+        self.nodes.add_control(code, checked_vars, self.indent_level)
+        self._record_control_dependence()
+        return checked_vars
+
+    def _record_control_dependence(self, controllers=None):
+        self.control_dependence.append(self._controllers if controllers is None else controllers)
+
+    def _build_and_merge_inner_graph(self, body, controllers):
+        inner_graph = self._build_inner_graph(body, controllers)
+        self._find_unknown_variables(inner_graph.unknown_vars)
+        return inner_graph
 
-        self.nodes.extend(inner_graph.nodes)
+    @timed('build.inner_blocks')
+    def _build_inner_graph(self, body, controllers):
+        """
+        Visit an inner block and merge its points-to domain, leaving its unknown variables to the caller
+        """
+        inner_graph = GraphBuilder(self.indent_level + 1, self._code_line + 1, self, controllers)
+        inner_graph.visit_body(body)
 
-        self._merge_edges(self.control_edges, inner_graph.control_edges)
-        self._merge_edges(self.dep_edges, inner_graph.dep_edges)
-        self._fix_inner_code_lines(inner_graph.last_seen)
-        self._find_unknown_variables(inner_graph.unknown_vars)
-        self._merge_objects(inner_graph.object_to_var, inner_graph.var_to_object)
+        self.points_to.merge(inner_graph.points_to)
 
         self._code_line += inner_graph.code_length
 
-        return inner_graph.last_seen, inner_graph.code_length
-
-    def _merge_objects(self, inner_objects_to_var, inner_var_to_objects):
-        for obj, vars in inner_objects_to_var.iteritems():
-            if '@' not in obj:  # Created new object in the inner code
-                self.object_to_var[obj] = inner_objects_to_var[obj]
-            else:   # Reference to object from outside
-                var_name = obj.rsplit('@')[-1]
-                if var_name in self.var_to_object:
-                    for found_object in self.var_to_object[var_name]:
-                        self.object_to_var[found_object] = self.object_to_var[found_object].union(vars)
-                else:   # We don't know this object either
-                    self.object_to_var[obj] = vars
-
-        for var, objects in inner_var_to_objects.iteritems():
-            if var not in self.var_to_object:
-                self.var_to_object[var] = set()
-            for obj in objects:
-                if '@' not in obj:  # Created new object in the inner code
-                    self.var_to_object[var].add(obj)
-                else:
-                    var_name = obj.rsplit('@')[-1]
-                    if var_name in self.var_to_object:
-                        correct_objects = self.var_to_object[var_name]
-                        for c_obj in correct_objects:
-                            self.var_to_object[var].add(c_obj)
-                            self.object_to_var[c_obj].add(var)
-                    else:
-                        self.var_to_object[var].add(obj)
-
-    def _find_unknown_variables(self, unknown_vars, reference_code_line=None):
-        self._fix_inner_code_lines(unknown_vars, reference_code_line)
+        return inner_graph
 
+    def _find_unknown_variables(self, unknown_vars):
         for var, inner_code_lines in unknown_vars.iteritems():
-            for inner_code_line in inner_code_lines:
-                if var in self.last_seen:
+            if var in self.last_seen:
+                for inner_code_line in inner_code_lines:
                     self._create_dep_edge([var], inner_code_line)
-                else:
-                    if var in self.unknown_vars:
-                        self.unknown_vars[var].extend(inner_code_lines)
-                    else:
-                        self.unknown_vars[var] = inner_code_lines
-
-    def _fix_inner_code_lines(self, inner_dict, reference_code_line=None):
-        for var in inner_dict:
-            fixed_code_lines = []
-            for code_line in inner_dict[var]:
-                fixed_code_lines.append(code_line + (self._code_line if not reference_code_line else reference_code_line) + 1)
-            inner_dict[var] = fixed_code_lines
-
-    def _merge_edges(self, outer_edges, inner_edges):
-        for edge in inner_edges:
-            outer_edges.append(Edge(edge.from_ + self._code_line + 1, edge.to + self._code_line + 1, edge.jmp_true))
+            elif var in self.unknown_vars:
+                self.unknown_vars[var].extend(inner_code_lines)
+            else:
+                self.unknown_vars[var] = list(inner_code_lines)
+
+
+@timed('build.to_source')
+def _to_source(node):
+    """
+    The text of a node without its source
+    """
+    import astor
+    return astor.codegen.to_source(node)
+
+
+def _copy_lists(mapping):
+    return dict((key, list(values)) for key, values in mapping.iteritems())
+
+
+def _contract_phis(ssa_edges, phis, kept):
+    """
+    The dependency map (node -> [nodes it depends on]) of ssa_edges, where the phis that don't save edges - most join two
+    definitions for a single use - are replaced by edges from what they join to their uses. The slicer walks through
+    the others, and through the kept phis, which a projection may start from
+    """
+    predecessors = dict((node, list(deps)) for node, deps in ssa_edges.predecessors.iteritems())
+    successors = dict((node, list(uses)) for node, uses in ssa_edges.successors.iteritems() if node < 0)
+    for phi in xrange(-1, -phis - 1, -1):
+        joined = predecessors.get(phi, [])
+        uses = successors.get(phi, [])
+        if len(joined) * len(uses) > len(joined) + len(uses) or phi in joined or phi in kept:
+            continue
+        for use in uses:
+            deps = predecessors[use]
+            deps.remove(phi)
+            deps.extend(joined)
+        for line in joined:
+            if line < 0:
+                joined_uses = successors[line]
+                joined_uses.remove(phi)
+                joined_uses.extend(uses)
+        predecessors.pop(phi, None)
+        successors.pop(phi, None)
+    return predecessors
+
+
+def _without_phis(ssa_edges):
+    """
+    The edges between nodes, with an edge from every definition a phi joins (through other phis too) to its uses
+    """
+    predecessors = ssa_edges.predecessors
+    joined = {}     # phi -> the definitions it joins, for the phis used by nodes
+    edges = EdgeSet()
+    for from_, to in ssa_edges.pairs():
+        if to < 0:
+            continue
+        if from_ >= 0:
+            edges.add(from_, to)
+            continue
+        if from_ not in joined:
+            definitions = set()
+            visited = set([from_])
+            pending = [from_]
+            while pending:
+                for line in predecessors.get(pending.pop(), ()):
+                    if line >= 0:
+                        definitions.add(line)
+                    elif line not in visited:
+                        visited.add(line)
+                        pending.append(line)
+            joined[from_] = sorted(definitions)
+        for line in joined[from_]:
+            edges.add(line, to)
+    return edges
 
 
 def create_graph(original_code, indent_level=0):
-    builder = GraphBuilder(indent_level)
-    builder.visit(ast.parse(original_code))
+    with STATS.phase('parse'):
+        module = ast.parse(original_code)
+        builder = GraphBuilder(indent_level, source=SourceText(original_code))
+    with STATS.phase('build'):
+        builder.visit(module)
+    builder.source = None   # Only needed while visiting, and not worth keeping with the graph
 
     return builder
 
 
+def create_graph_from_file(code_file, chunk_size=CHUNK_SIZE):
+    """
+    The graph of a code file, memory mapped and parsed about chunk_size bytes of top level statements at a time. The
+    builder visits every chunk in turn, keeping its state between them, so only one chunk of the text and its AST are
+    alive at once. Returns the graph and the last line of the code
+    """
+    with open(code_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:  # Can't be mapped
+            return create_graph(''), ''
+        code = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # The builder makes no reference cycles, and with only a chunk of AST alive the collector would otherwise walk the
+    # growing graph over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        builder = GraphBuilder(0)
+        for chunk, module in _top_level_chunks(code, chunk_size):
+            with STATS.phase('build'):
+                builder.source = SourceText(chunk)
+                builder.visit(module)
+            builder.source = None
+        return builder, code[code.rfind('\n') + 1:]
+    finally:
+        if collecting:
+            gc.enable()
+        code.close()
+
+
+_CONTINUATION = re.compile(r'(else|elif|except|finally)\b|[\s#]')
+
+
+def _top_level_chunks(code, chunk_size):
+    """
+    (chunk, its AST) of the code split into chunks of top level statements, each ending at the first line after
+    chunk_size bytes that may start a top level statement. A split inside a string or brackets doesn't parse, the chunk
+    is then tried again twice as long
+    """
+    start = 0
+    position = chunk_size
+    while True:
+        newline = code.find('\n', position) if position < len(code) else -1
+        if newline == -1:
+            chunk = code[start:]
+            with STATS.phase('parse'):
+                module = ast.parse(chunk)
+            yield chunk, module
+            return
+        end = newline + 1
+        if _CONTINUATION.match(code[end:end + 8]) or end == len(code):
+            position = end
+            continue
+        chunk = code[start:end]
+        try:
+            with STATS.phase('parse'):
+                module = ast.parse(chunk)
+        except SyntaxError:
+            position = end + len(chunk)
+            continue
+        yield chunk, module
+        start = end
+        position = end + chunk_size
+
+
 def create_projected_variable_path(code, projected_variable):
-    if code.split('\n')[-1] == projected_variable:
-        program_graph = create_graph(code)
-        changed = False
-    else:
-        program_graph = create_graph(code + "\n" + projected_variable)
-        changed = True
-    dep_map = {}
-    control_map = {}
-    r_control_map = {}
-    r_dep_map = {}
-    required = set()
-    for edge in program_graph.dep_edges:
-        if edge.to not in dep_map:
-            dep_map[edge.to] = []
-        dep_map[edge.to].append(edge.from_)
-    for edge in program_graph.control_edges:
-        if edge.from_ not in control_map:
-            control_map[edge.from_] = []
-        control_map[edge.from_].append(edge.to)
-
-    for edge in program_graph.dep_edges:
-        if edge.from_ not in r_dep_map:
-            r_dep_map[edge.from_] = []
-        r_dep_map[edge.from_].append(edge.to)
-
-    for edge in program_graph.control_edges:
-        if edge.to > edge.from_:
-            if edge.to not in r_control_map:
-                r_control_map[edge.to] = []
-            r_control_map[edge.to].append(edge.from_)
-
-    for i in xrange(len(program_graph.nodes)):
-        pos = len(program_graph.nodes) - i - 1
-        g = program_graph.nodes[pos]
-        if (isinstance(g, StatementNode) and g.assigned_var.split("#")[0] == projected_variable) or i == 0:
-            r = set()
-            r.add(pos)
-            post_len = 0
-            pre_len = 1
-
-            #add dependencies
-            r = get_dependencies(dep_map, pos, r)
-            required = required.union(r)
-
-            #add every branch on the way to the node
-
-    r = set()
-    pre_len = 1
-    post_len = pre_len - 1
-    while pre_len != post_len:
-        pre_len  = len(required)
-        for pos in required:
-            r = r.union(recurse_walk(program_graph, control_map, dep_map, pos, r, r_control_map))
-        required = required.union(r)
-        post_len  = len(required)
-
-    required = list(required)
-    if changed:
-        return sorted(required)[:-1]
+    return project_many(code, [projected_variable])[projected_variable]
+
+
+def project_many(code, variables):
+    """
+    Project several variables of the same code, building its graph only once
+    """
+    slices = project_all(create_graph(code), variables, code.rsplit('\n', 1)[-1])
+    return dict((var, slices.lines(var)) for var in variables)
+
+
+@timed('project')
+def project_variable(program_graph, projected_variable, query_in_code=False):
+    """
+    The projection is seeded by the assignments of projected_variable and by a query statement - the code's last line
+    if it is the variable itself (query_in_code), otherwise a virtual one right after the last node. Everything they
+    depend on, through data or through the branches that control them, is in the projection
+    """
+    seeds = _projection_seeds(program_graph, projected_variable, query_in_code)
+    return list(iter_bits(program_graph.dependence.closure_of(seeds)))
+
+
+class SliceMatrix(object):
+    """
+    The projections of many variables as a variables x lines membership matrix, a bitset row per variable
+    """
+    def __init__(self, variables, rows):
+        self.variables = variables
+        self._rows = dict(zip(variables, rows))
+
+    def __contains__(self, cell):
+        variable, line = cell
+        return bool(self._rows[variable] >> line & 1)
+
+    def row(self, variable):
+        return self._rows[variable]
+
+    def lines(self, variable):
+        """
+        The projection of variable, as project_variable gives it
+        """
+        return list(iter_bits(self._rows[variable]))
+
+
+@timed('project')
+def project_all(program_graph, variables=None, last_line=None):
+    """
+    The SliceMatrix of variables, every assigned variable by default, closing the dependencies of all of them in one
+    pass. The query of a variable that is the code's last_line is that line, as in project_variable
+    """
+    if variables is None:
+        variables = program_graph.nodes.assigned_variables()
+    seeds = [_projection_seeds(program_graph, variable, variable == last_line) for variable in variables]
+    return SliceMatrix(variables, program_graph.dependence.closures_of_many(seeds))
+
+
+@timed('project')
+def forward_slice(program_graph, lines):
+    """
+    The lines influenced by lines, lines included - every line depending on one of them through data or through the
+    branches they decide
+    """
+    return sorted(program_graph.dependence.influenced(lines))
+
+
+def forward_project_variable(program_graph, variable):
+    """
+    The lines influenced by the assignments of variable and of its attributes
+    """
+    return forward_slice(program_graph, _assignments(program_graph, variable))
+
+
+@timed('project')
+def chop(program_graph, source_variable, target_variable, query_in_code=False):
+    """
+    The lines on the dependency paths from the assignments of source_variable to the projection of target_variable -
+    the lines influenced by the former that the latter depends on
+    """
+    return sorted(program_graph.dependence.chop(_assignments(program_graph, source_variable),
+                                                _projection_seeds(program_graph, target_variable, query_in_code)))
+
+
+def with_controllers(program_graph, lines):
+    """
+    lines and the control nodes they are transitively under, sorted - the if, else and while lines their statements need
+    to be written as code
+    """
+    control_dependence = program_graph.control_dependence
+    closed = set(lines)
+    pending = list(closed)
+    while pending:
+        for controller in control_dependence[pending.pop()]:
+            if controller not in closed:
+                closed.add(controller)
+                pending.append(controller)
+    return sorted(closed)
+
+
+def _assignments(program_graph, variable):
+    nodes = program_graph.nodes
+    symbol = nodes.symbols.find_variable(variable)
+    if symbol is None:
+        return []
+    return nodes.assigning([symbol] + list(nodes.symbols.attributes(symbol)))
+
+
+def _projection_seeds(program_graph, projected_variable, query_in_code):
+    nodes = program_graph.nodes
+    if query_in_code:
+        seeds = [len(nodes) - 1]
     else:
-        return sorted(required)
-
-
-def recurse_walk(program_graph, control_map, dep_map, pos, r, r_control_map):
-    if pos in r_control_map:
-        prev = r_control_map[pos]
-
-        while prev is not 0:
-            l = prev
-            for prev in l:
-                if len(control_map[prev]) == 2:# or program_graph.nodes[prev].statement in ["else", "elif"]:
-                    low = control_map[prev][0]
-                    high = control_map[prev][1]
-                    if low < pos and pos < high or pos in [low, high]:
-                        r.add(prev)
-                        if pos in [low, high]:
-                            if isinstance(program_graph.nodes[pos - 1], ControlNode):
-                                r.add(pos-1)
-                        r = get_dependencies(dep_map, prev, r)
-                if prev not in r_control_map:
-                    break
-                prev = r_control_map[prev]
-    return r
-
-
-def get_dependencies(dep_map, pos, r):
-    r = set()
-    r.add(pos)
-    post_len = 0
-    pre_len = 1
-    while pre_len != post_len:
-        pre_len = len(r)
-        for i in r:
-            if i in dep_map:
-                r = r.union(dep_map[i])
-        post_len = len(r)
-    return r
+        seeds = list(program_graph.query_dependencies(projected_variable))
+    seeds.extend(_assignments(program_graph, projected_variable))
+    return seeds
 
 
 def build_program(program_graph, projected_path):
@@ -488,6 +997,7 @@ def build_program(program_graph, projected_path):
     return program
 
 
+@timed('output')
 def output_analysis_result(graph, output_directory):
     from tabulate import tabulate
     headers = ['#line', 'assigned variable', 'influence variables', 'statement']
@@ -504,33 +1014,229 @@ def output_analysis_result(graph, output_directory):
         f.write('Dependency Edges: ' + str(graph.dep_edges))
 
 
-def output_code(graph, relevant_nodes, output_dir):
-    with file(output_dir + os.path.sep + 'projected_code.py', 'w') as f:
+def analysis_records(graph):
+    """
+    Every node, control edge and dependency edge of the graph as a JSON-able dict
+    """
+    kinds = {NodeTable.STATEMENT: 'statement', NodeTable.CONTROL: 'control', NodeTable.ELSE: 'else'}
+    nodes = graph.nodes
+    for index in xrange(len(nodes)):
+        yield {'type': 'node', 'line': index, 'kind': kinds[nodes.kind(index)], 'indent': nodes.indent(index),
+               'statement': nodes.statement(index), 'assigned_var': nodes.assigned_var(index),
+               'variables': nodes.variables(index)}
+    for edge in graph.control_edges:
+        yield {'type': 'control_edge', 'from': edge.from_, 'to': edge.to, 'jmp_true': edge.jmp_true}
+    for from_, to in graph.dep_edges.pairs():
+        yield {'type': 'dep_edge', 'from': from_, 'to': to}
+
+
+@timed('output')
+def output_jsonl(graph, project, projected_variables, output_directory, analysis=True):
+    """
+    The analysis as one JSON record per line - every node, control edge and dependency edge (if analysis) and the
+    projection of every variable, each written as soon as it is produced
+    """
+    import json
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    with file(output_directory + os.sep + 'analysis_result.jsonl', 'w') as f:
+        if analysis:
+            for record in analysis_records(graph):
+                f.write(encode(record) + '\n')
+        for projected_variable in projected_variables:
+            f.write(encode({'type': 'projection', 'variable': projected_variable,
+                            'lines': project(projected_variable)}) + '\n')
+
+
+@timed('output')
+def output_code(graph, relevant_nodes, output_dir, file_name='projected_code.py'):
+    """
+    Write the nodes as code, a pass in every if, else or while left without the statements of its block
+    """
+    nodes = graph.nodes
+    with file(output_dir + os.path.sep + file_name, 'w') as f:
+        control_indent = None   # The indent of the last line written, if a control line
         for node_number in relevant_nodes:
-            if isinstance(graph.nodes[node_number-1], ControlNode) and graph.nodes[node_number-1].statement == 'else:':
-                f.write('\t'*graph.nodes[node_number-1].indent + graph.nodes[node_number-1].statement + '\n')
-            f.write('\t'*graph.nodes[node_number].indent + graph.nodes[node_number].statement + '\n')
+            indent = nodes.indent(node_number)
+            if control_indent is not None and indent <= control_indent:
+                f.write('\t'*(control_indent + 1) + 'pass\n')
+            f.write('\t'*indent + nodes.statement(node_number) + '\n')
+            control_indent = indent if nodes.kind(node_number) != NodeTable.STATEMENT else None
+        if control_indent is not None:
+            f.write('\t'*(control_indent + 1) + 'pass\n')
+
+
+def _ends_with(code, line):
+    return code.rsplit('\n', 1)[-1] == line
+
+
+def output_results(graph, project, projected_variables, output_directory, graphs=True, render=False,
+                   max_graph_nodes=MAX_NODES, output_format='text', analysis=True):
+    """
+    project(variable) gives the projection of a variable, it is called as the projection is written.
+    graphs writes the DOT files of the graph, render also lays them out in the background. A graph of more than
+    max_graph_nodes nodes is drawn only around the projections.
+    output_format is text - analysis_result.txt and the projected codes, or jsonl - analysis_result.jsonl. Without
+    analysis only the projections are written, and neither the table nor the graphs module is used.
+    Returns the rendering threads
+    """
+    renders = []
+    if graphs:
+        focus = None
+        if max_graph_nodes is not None and len(graph.nodes) > max_graph_nodes:
+            focus = set()
+            for projected_variable in projected_variables:
+                focus.update(project(projected_variable))
+        renders = visualize(graph, output_directory + os.path.sep + 'out.gv', render, max_graph_nodes, focus)
+
+    if output_format == 'jsonl':
+        output_jsonl(graph, project, projected_variables, output_directory, analysis)
+        return renders
+
+    if analysis:
+        output_analysis_result(graph, output_directory)
+    for projected_variable in projected_variables:
+        if len(projected_variables) == 1:
+            output_code(graph, project(projected_variable), output_directory)
+        else:
+            output_code(graph, project(projected_variable), output_directory, 'projected_code_%s.py' % projected_variable)
+    return renders
+
+
+def print_stats(graph, out=sys.stderr):
+    """
+    The time spent in every phase so far and the size of the graph
+    """
+    for line in STATS.report():
+        print >> out, line
+    for metric, value in graph_metrics(graph):
+        print >> out, '%-30s %10s' % (metric, value)
+
+
+def watch(code_file, output_directory, projected_variables, interval=0.5, **output_options):
+    """
+    Project again whenever code_file is saved, rebuilding the graph only from the first top level statement that changed
+    """
+    from session import AnalysisSession
+    session = AnalysisSession()
+    modified = None
+    while True:
+        graph = None
+        try:
+            saved = os.path.getmtime(code_file)
+            if saved != modified:
+                modified = saved
+                with file(code_file) as f:
+                    code = f.read()
+                graph = session.update(code)
+        # Saved in the middle of an edit - gone for a moment, doesn't parse, or has what the builder can't build
+        except Exception as e:
+            print >> sys.stderr, 'Skipping %s: %s: %s' % (code_file, type(e).__name__, e)
+        if graph is not None:
+            output_results(graph, session.project, projected_variables, output_directory, **output_options)
+            if STATS.enabled:
+                print_stats(graph)
+                STATS.reset()
+        time.sleep(interval)
 
 
 def main():
-    if len(sys.argv) != 4:
-        raise RuntimeError('Illegal number of arguments.' + os.linesep +
-                           'Execution line should be: python projector.py <code_file> <output_dir> <projected_variable>')
-    code_file = sys.argv[1]
-    output_directory = sys.argv[2]
-    projected_variable = sys.argv[3]
-
-    with file(code_file) as f:
-        code = f.read()
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    options = dict(argument[2:].partition('=')[::2] for argument in sys.argv[1:] if argument.startswith('--'))
+    STATS.enabled = 'stats' in options
+    if options.get('profile'):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, arguments, options)
+        finally:
+            profiler.dump_stats(options['profile'])
+    else:
+        run(arguments, options)
 
-    graph = create_graph(code)
-    output_analysis_result(graph, output_directory)
 
-    visualize(graph, output_directory + os.path.sep + 'out.gv')
+def run(arguments, options):
+    """
+    Run the command line of main
+    """
+    if 'serve' in options:
+        from server import SlicingServer
+        if options['serve']:
+            SlicingServer().serve_unix_socket(options['serve'])
+        else:
+            SlicingServer().serve()
+        return
 
-    relevant_nodes = create_projected_variable_path(code, projected_variable)
-    output_code(graph, relevant_nodes, output_directory)
+    output_format = options.get('format') or 'text'
+    if len(arguments) < (2 if 'corpus' in options or 'all-slices' in options else 3) or \
+            output_format not in ('text', 'jsonl'):
+        raise RuntimeError('Illegal number of arguments.' + os.linesep +
+                           'Execution line should be: python projector.py [--watch] [--render] [--max-graph-nodes=<n>] '
+                           '[--cache=<cache_dir>] [--format=text|jsonl] [--slice-only] [--stats] '
+                           '[--profile=<profile_file>] <code_file> <output_dir> <projected_variable> '
+                           '[<projected_variable> ...]' + os.linesep +
+                           'or, for the lines influenced by variables or lines, or on the paths from a variable to '
+                           'others: python projector.py --forward|--chop=<source_variable> [...] <code_file> '
+                           '<output_dir> <variable_or_line> [<variable_or_line> ...]' + os.linesep +
+                           'or: python projector.py --all-slices [--cache=<cache_dir>] [--format=text|jsonl] '
+                           '[--slice-only] [--stats] <code_file> <output_dir> [<projected_variable> ...]' + os.linesep +
+                           'or: python projector.py --corpus [--processes=<n>] [--cache=<cache_dir>] '
+                           '[--format=text|jsonl] [--slice-only] <code_dir_or_manifest> <output_dir> '
+                           '[<projected_variable> ...]' +
+                           os.linesep + 'or: python projector.py --serve[=<unix_socket>]')
+    code_file = arguments[0]
+    output_directory = arguments[1]
+    projected_variables = arguments[2:]
+
+    slice_only = 'slice-only' in options
+    output_options = dict(render='render' in options, output_format=output_format,
+                          max_graph_nodes=int(options.get('max-graph-nodes') or MAX_NODES),
+                          graphs=not slice_only, analysis=not slice_only)
+
+    if 'corpus' in options:
+        from corpus import run_corpus
+        processes = int(options['processes']) if options.get('processes') else None
+        if run_corpus(code_file, output_directory, projected_variables, processes, options.get('cache'), output_format,
+                      not slice_only):
+            sys.exit(1)
+        return
+
+    if 'watch' in options:
+        watch(code_file, output_directory, projected_variables, **output_options)
+        return
+
+    if 'cache' in options:
+        from cache import GraphCache
+        with file(code_file) as f:
+            code = f.read()
+        graph = GraphCache(options['cache']).graph(code)
+        last_line = code.rsplit('\n', 1)[-1]
+    else:
+        graph, last_line = create_graph_from_file(code_file)
+    if 'all-slices' in options:     # Every assigned variable, unless some are given
+        slices = project_all(graph, projected_variables or None, last_line)
+        project, projected_variables = slices.lines, slices.variables
+    elif 'forward' in options:
+        for criterion in projected_variables:
+            if criterion.isdigit() and int(criterion) >= len(graph.nodes):
+                raise RuntimeError('No line %s in %s, its lines are 0 to %d' %
+                                   (criterion, code_file, len(graph.nodes) - 1))
+        project = lambda criterion: forward_slice(graph, [int(criterion)]) if criterion.isdigit() else \
+            forward_project_variable(graph, criterion)
+    elif options.get('chop'):
+        project = lambda var: chop(graph, options['chop'], var, var == last_line)
+    else:
+        project = lambda var: project_variable(graph, var, var == last_line)
+    if output_format == 'text' and ('forward' in options or options.get('chop')):
+        lines_of = project  # Written as code, the lines need the branches they are in
+        project = lambda criterion: with_controllers(graph, lines_of(criterion))
+    renders = output_results(graph, project, projected_variables, output_directory, **output_options)
+    if STATS.enabled:
+        for thread in renders:
+            thread.join()
+        print_stats(graph)
 
 
 if __name__ == '__main__':
-    main()
+    # Run the imported module, so its classes are the ones the other modules (session) import
+    import projector
+    projector.main()
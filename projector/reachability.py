@@ -0,0 +1,198 @@
+import binascii
+
+
+def to_bitset(nodes):
+    if not nodes:
+        return 0
+    buf = bytearray((max(nodes) >> 3) + 1)
+    for node in nodes:
+        buf[node >> 3] |= 1 << (node & 7)
+    buf.reverse()
+    return int(binascii.hexlify(bytes(buf)), 16)
+
+
+def iter_bits(bitset):
+    digits = bin(bitset)[:1:-1]    # Least significant bit first, without the '0b'
+    position = digits.find('1')
+    while position != -1:
+        yield position
+        position = digits.find('1', position + 1)
+
+
+class ReachabilityIndex(object):
+    """
+    Backward closures over a dependency map (node -> [nodes it depends on]). Every closure is computed once by a
+    worklist walk, which stops at nodes whose closure is already known, and is kept as a bitset. Negative nodes (phis)
+    are walked through but never part of a closure
+    """
+    def __init__(self, predecessors, closures=()):
+        """
+        closures are already known closures of the same nodes, kept from an index of an earlier version of the graph
+        """
+        self._predecessors = predecessors
+        self._closures = dict(closures)
+        self._successors = None
+
+    def closure(self, node):
+        """
+        Bitset of node and every node it transitively depends on
+        """
+        known = self._closures.get(node)
+        if known is not None:
+            return known
+
+        reached = 0
+        visited = set([node])
+        pending = [node]
+        predecessors = self._predecessors.get
+        known_closure = self._closures.get
+        visit = visited.add
+        push = pending.append
+        while pending:
+            for dependency in predecessors(pending.pop(), ()):
+                if dependency in visited:
+                    continue
+                visit(dependency)
+                dependency_closure = known_closure(dependency)
+                if dependency_closure is None:
+                    push(dependency)
+                else:
+                    reached |= dependency_closure
+
+        reached |= to_bitset([visited_node for visited_node in visited if visited_node >= 0])
+        self._closures[node] = reached
+        return reached
+
+    def closure_of(self, nodes):
+        reached = 0
+        for node in nodes:
+            reached |= self.closure(node)
+        return reached
+
+    def closures_of_many(self, node_sets):
+        """
+        The closure_of of every node set, in one pass over the nodes they reach. The strongly connected components of
+        the dependencies are closed in the order Tarjan's algorithm finds them, every component after the ones it
+        depends on, so each dependency costs a single bitset or. The bitset of a component is dropped as soon as the
+        components depending on it are closed
+        """
+        results = [0] * len(node_sets)
+        seeding = {}    # node -> the indices of the node sets it is in
+        for position, nodes in enumerate(node_sets):
+            for node in nodes:
+                seeding.setdefault(node, []).append(position)
+        known = self._closures
+
+        def dependencies(node):
+            return () if node in known else self._predecessors.get(node, ())
+
+        # The number of dependencies on every reached node, to know when its component's bitset is no longer needed
+        users = dict((node, 0) for node in seeding)
+        pending = list(seeding)
+        while pending:
+            for dependency in dependencies(pending.pop()):
+                if dependency in users:
+                    users[dependency] += 1
+                else:
+                    users[dependency] = 1
+                    pending.append(dependency)
+
+        order = {}      # node -> the order Tarjan's algorithm reached it in
+        lowest = {}
+        stack = []
+        component = {}  # node -> its closed component
+        closures = {}   # closed component -> its bitset, while some component depending on it isn't closed
+        remaining = {}  # closed component -> the dependencies on it from components not closed yet
+        for root in seeding:
+            if root in order:
+                continue
+            order[root] = lowest[root] = len(order)
+            stack.append(root)
+            walk = [(root, iter(dependencies(root)))]
+            while walk:
+                node, node_dependencies = walk[-1]
+                for dependency in node_dependencies:
+                    if dependency not in order:
+                        order[dependency] = lowest[dependency] = len(order)
+                        stack.append(dependency)
+                        walk.append((dependency, iter(dependencies(dependency))))
+                        break
+                    if dependency not in component and order[dependency] < lowest[node]:
+                        lowest[node] = order[dependency]
+                else:
+                    walk.pop()
+                    if walk and lowest[node] < lowest[walk[-1][0]]:
+                        lowest[walk[-1][0]] = lowest[node]
+                    if lowest[node] != order[node]:
+                        continue
+                    members = []
+                    while not members or members[-1] != node:
+                        members.append(stack.pop())
+                        component[members[-1]] = node
+                    reached = known.get(node, 0) | to_bitset([member for member in members if member >= 0])
+                    used = 0
+                    for member in members:
+                        used += users[member]
+                        for dependency in dependencies(member):
+                            closed = component[dependency]
+                            if closed == node:
+                                used -= 1
+                                continue
+                            reached |= closures[closed]
+                            remaining[closed] -= 1
+                            if not remaining[closed]:
+                                del closures[closed], remaining[closed]
+                    for member in members:
+                        for position in seeding.get(member, ()):
+                            results[position] |= reached
+                    if used:
+                        closures[node] = reached
+                        remaining[node] = used
+        return results
+
+    def influenced(self, nodes):
+        """
+        The set of nodes and every node transitively depending on one of them. The dependency map is reversed on the
+        first call, after that a call only walks the nodes it finds
+        """
+        return set(node for node in _walk(nodes, self._dependents()) if node >= 0)
+
+    def chop(self, sources, targets):
+        """
+        The set of nodes on the dependency paths from sources to targets - the nodes influenced by sources that targets
+        depend on. Such paths never leave what sources influence, so only that is walked
+        """
+        influenced = _walk(sources, self._dependents())
+        on_paths = _walk([target for target in targets if target in influenced], self._predecessors.get, influenced)
+        return set(node for node in on_paths if node >= 0)
+
+    def _dependents(self):
+        if self._successors is None:
+            self._successors = {}
+            for node, dependencies in self._predecessors.iteritems():
+                for dependency in dependencies:
+                    self._successors.setdefault(dependency, []).append(node)
+        return self._successors.get
+
+    def dependencies(self, node):
+        return set(iter_bits(self.closure(node)))
+
+    def closures_before(self, node):
+        """
+        The known closures of the nodes before node. Those of the phis are left out, a rollback gives their ids again
+        """
+        return dict(item for item in self._closures.iteritems() if 0 <= item[0] < node)
+
+
+def _walk(nodes, adjacent, within=None):
+    """
+    The nodes reachable from nodes through adjacent (node, default -> nodes), only through those in within if given
+    """
+    visited = set(nodes)
+    pending = list(visited)
+    while pending:
+        for other in adjacent(pending.pop(), ()):
+            if other not in visited and (within is None or other in within):
+                visited.add(other)
+                pending.append(other)
+    return visited
@@ -0,0 +1,203 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from projector import analysis_records
+from session import AnalysisSession
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+ANALYSIS_ERROR = -32000
+
+
+class InvalidParams(Exception):
+    pass
+
+
+class _WarmFile(object):
+    __slots__ = ('lock', 'session', 'digest')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = AnalysisSession(lazy_checkpoints=True)
+        self.digest = None
+
+
+class SlicingServer(object):
+    """
+    Answers JSON-RPC requests, one per line, keeping the graphs of the last max_files files it was asked about. A
+    file is analysed again only when its content hash changes, and then incrementally once it has changed before - the
+    graph of a file never edited takes no more than create_graph's. Requests about different files run concurrently
+    """
+    def __init__(self, max_files=32):
+        self.max_files = max_files
+        self._files = OrderedDict()     # path -> _WarmFile, least recently used first
+        self._lock = threading.Lock()
+        self.methods = {'project': self.project, 'analysis': self.analysis}
+
+    def project(self, file, var=None, variables=None, code=None):
+        """
+        The projection of var, or {variable: projection} for every one of variables. code is the file's content if it
+        isn't saved yet
+        """
+        with self._warm_session(file, code) as session:
+            if variables is None:
+                return session.project(var)
+            return session.project_many(variables)
+
+    def analysis(self, file, code=None):
+        with self._warm_session(file, code) as session:
+            result = {'node': [], 'control_edge': [], 'dep_edge': []}
+            for record in analysis_records(session.graph):
+                result[record.pop('type')].append(record)
+            return {'nodes': result['node'], 'control_edges': result['control_edge'], 'dep_edges': result['dep_edge']}
+
+    def handle(self, line):
+        """
+        The JSON-RPC response to a request line, None for a notification
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return _response(None, error=(PARSE_ERROR, str(e)))
+        if not isinstance(request, dict) or 'method' not in request:
+            return _response(None, error=(INVALID_REQUEST, 'Not a JSON-RPC request'))
+
+        method = self.methods.get(request['method'])
+        if method is None:
+            response = _response(request.get('id'), error=(METHOD_NOT_FOUND, request['method']))
+        else:
+            try:
+                arguments = self._arguments(method, request.get('params', {}))
+                result = method(**arguments)
+            except InvalidParams as e:
+                response = _response(request.get('id'), error=(INVALID_PARAMS, str(e)))
+            except Exception as e:
+                response = _response(request.get('id'), error=(ANALYSIS_ERROR, '%s: %s' % (type(e).__name__, e)))
+            else:
+                response = _response(request.get('id'), result)
+        return response if 'id' in request else None
+
+    def _arguments(self, method, params):
+        """
+        The arguments of method by name, from the params of a request. Raises InvalidParams if they don't fit it
+        """
+        if isinstance(params, list):
+            args, kwargs = params, {}
+        elif isinstance(params, dict):
+            args, kwargs = [], dict((name.encode('utf-8'), value) for name, value in params.iteritems())
+        else:
+            raise InvalidParams('params must be an array or an object')
+        try:
+            arguments = inspect.getcallargs(method, *args, **kwargs)
+        except TypeError as e:
+            raise InvalidParams(str(e))
+        del arguments['self']
+        if method == self.project and (arguments['var'] is None) == (arguments['variables'] is None):
+            raise InvalidParams('project takes either var or variables')
+        return arguments
+
+    def serve(self, requests=sys.stdin, responses=sys.stdout):
+        for line in iter(requests.readline, ''):
+            if not line.strip():
+                continue
+            response = self.handle(line)
+            if response is not None:
+                responses.write(response + '\n')
+                responses.flush()
+
+    def serve_unix_socket(self, path):
+        """
+        Serve every connection to the socket on its own thread
+        """
+        server = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                server.serve(self.rfile, self.wfile)
+
+        if os.path.exists(path):
+            os.remove(path)
+        socket_server = _ThreadingUnixStreamServer(path, Handler)
+        try:
+            socket_server.serve_forever()
+        finally:
+            socket_server.server_close()
+            os.remove(path)
+
+    def _warm_session(self, path, code=None):
+        path = os.path.abspath(path)
+        with self._lock:
+            warm_file = self._files.get(path) or _WarmFile()
+        return _LockedSession(self, warm_file, path, code)
+
+    def _keep(self, path, warm_file):
+        """
+        Make a file just analysed the most recently used one, so a file that can't be read or analysed never evicts
+        another
+        """
+        with self._lock:
+            self._files.pop(path, None)
+            self._files[path] = warm_file
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+
+
+class _LockedSession(object):
+    """
+    Holds the file's lock while its session is used, bringing the session up to date with the file first. A session
+    whose update failed is replaced, since its graph may be left anywhere
+    """
+    def __init__(self, server, warm_file, path, code):
+        self._server = server
+        self._warm_file = warm_file
+        self._path = path
+        self._code = code
+
+    def __enter__(self):
+        warm_file = self._warm_file
+        warm_file.lock.acquire()
+        try:
+            code = self._code
+            if code is None:
+                with file(self._path) as f:
+                    code = f.read()
+            elif isinstance(code, unicode):
+                code = code.encode('utf-8')
+            digest = hashlib.sha1(code).digest()
+            if digest != warm_file.digest:
+                warm_file.digest = None
+                try:
+                    warm_file.session.update(code)
+                except BaseException:
+                    warm_file.session = AnalysisSession(lazy_checkpoints=True)
+                    raise
+                warm_file.digest = digest
+            self._server._keep(self._path, warm_file)
+        except BaseException:
+            warm_file.lock.release()
+            raise
+        return warm_file.session
+
+    def __exit__(self, *exc_info):
+        self._warm_file.lock.release()
+
+
+class _ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def _response(request_id, result=None, error=None):
+    response = {'jsonrpc': '2.0', 'id': request_id}
+    if error is None:
+        response['result'] = result
+    else:
+        response['error'] = {'code': error[0], 'message': error[1]}
+    return json.dumps(response, separators=(',', ':'))
@@ -0,0 +1,111 @@
+import ast
+
+from projector import GraphBuilder, project_variable, project_all, _ends_with
+from source_text import SourceText
+from stats import STATS
+
+
+class AnalysisSession(object):
+    """
+    The graph of the last version of a code, kept between versions. update rebuilds it only from the first top level
+    statement whose text changed - the builder rolls back to the checkpoint before it and visits the rest. The projections
+    of an unchanged code are reused, and projecting a changed one only walks the nodes after the change.
+    Rolling back the aliases takes a log of their changes, which grows with the work of building rather than with the
+    graph. The oldest checkpoints are dropped as soon as the log outgrows the aliases themselves, and a change before the
+    first checkpoint left is built from scratch
+    """
+    def __init__(self, checkpoint_interval=16, lazy_checkpoints=False):
+        """
+        lazy_checkpoints builds the first version without checkpoints, as create_graph does, for codes that are seldom
+        changed. The first change builds the code again with them
+        """
+        self.checkpoint_interval = checkpoint_interval
+        self.lazy_checkpoints = lazy_checkpoints
+        self.code = None
+        self.graph = None
+        self._statements = []       # The text of every top level statement, up to the next one
+        self._checkpoints = []      # (top level statement index, builder checkpoint before it)
+        self._projections = {}
+
+    def update(self, code):
+        """
+        Analyse a new version of the code, returns its graph
+        """
+        with STATS.phase('parse'):
+            module = ast.parse(code)
+            source = SourceText(code)
+            starts = [0] + [source.offset(statement.lineno, statement.col_offset) for statement in module.body[1:]]
+            ends = starts[1:] + [source.code_end(module.body[-1].lineno) if module.body else 0]
+            statements = [code[start:end] for start, end in zip(starts, ends)]
+        self.code = code
+
+        unchanged = 0
+        while unchanged < min(len(statements), len(self._statements)) and \
+                statements[unchanged] == self._statements[unchanged]:
+            unchanged += 1
+        if self.graph is not None and unchanged == len(statements) == len(self._statements):
+            return self.graph
+
+        while self._checkpoints and self._checkpoints[-1][0] > unchanged:
+            self._checkpoints.pop()
+        checkpointing = self.graph is not None or not self.lazy_checkpoints
+        if not self._checkpoints or self._checkpoints[-1][0] == 0:     # Nothing to keep, building anew is quicker
+            self.graph = GraphBuilder(0)
+            self._checkpoints = [(0, self.graph.checkpoint())] if checkpointing else []
+            unchanged = 0
+        else:
+            unchanged, checkpoint = self._checkpoints[-1]
+            self.graph.rollback(checkpoint)
+
+        with STATS.phase('build'):
+            self.graph.source = source
+            try:
+                for index in xrange(unchanged, len(module.body)):
+                    if checkpointing and index % self.checkpoint_interval == 0 and \
+                            (not self._checkpoints or self._checkpoints[-1][0] < index):
+                        self._checkpoints.append((index, self.graph.checkpoint()))
+                        self._release_checkpoints()
+                    self.graph.visit(module.body[index])
+            except BaseException:
+                # Back to the last statements known to be built right, the next update goes on from there
+                while self._checkpoints and self._checkpoints[-1][0] > unchanged:
+                    self._checkpoints.pop()
+                if self._checkpoints:
+                    self.graph.rollback(self._checkpoints[-1][1])
+                    self._statements = statements[:unchanged]
+                else:   # Released while building, the next update starts over
+                    self._statements = []
+                self._projections = {}
+                raise
+            finally:
+                self.graph.source = None
+
+        self._release_checkpoints()
+        self._statements = statements
+        self._projections = {}
+        return self.graph
+
+    def _release_checkpoints(self):
+        points_to = self.graph.points_to
+        while len(self._checkpoints) > 1 and points_to.undo_size() > points_to.size():
+            del self._checkpoints[0]
+            self.graph.release(self._checkpoints[0][1])
+
+    def project(self, projected_variable):
+        query_in_code = _ends_with(self.code, projected_variable)
+        key = (projected_variable, query_in_code)
+        if key not in self._projections:
+            self._projections[key] = project_variable(self.graph, projected_variable, query_in_code)
+        return self._projections[key]
+
+    def project_many(self, variables):
+        """
+        The projections of variables, those not projected yet closed together
+        """
+        last_line = self.code.rsplit('\n', 1)[-1]
+        missing = [var for var in set(variables) if (var, var == last_line) not in self._projections]
+        if missing:
+            slices = project_all(self.graph, missing, last_line)
+            for var in missing:
+                self._projections[(var, var == last_line)] = slices.lines(var)
+        return dict((var, self.project(var)) for var in variables)
@@ -0,0 +1,124 @@
+import re
+import tokenize
+from StringIO import StringIO
+
+_SKIPPED = (tokenize.COMMENT, tokenize.NL, tokenize.INDENT, tokenize.DEDENT)
+_ENDS = (tokenize.NEWLINE, tokenize.ENDMARKER)
+_OPENING = ('(', '[', '{')
+_CLOSING = (')', ']', '}')
+_NEEDS_TOKENS = re.compile(r'[#;\\\'"]')
+
+
+class SourceText(object):
+    """
+    The text of the statements of a code, sliced from the code itself rather than generated from their AST, so it keeps
+    the code's own formatting. A statement ends at the first newline or semicolon out of brackets after its start
+    (comments left out), a compound statement header at its colon. A statement that is the rest of its line - no
+    strings, comments, semicolons or continuation - is sliced as it is, the code is tokenized (once) only for the others
+    """
+    def __init__(self, code):
+        self.code = code
+        self._line_offsets = [0]
+        position = code.find('\n')
+        while position != -1:
+            self._line_offsets.append(position + 1)
+            position = code.find('\n', position + 1)
+        self._tokens = None
+        self._token_at = None   # (row, column) -> the index of the token starting there
+
+    def offset(self, lineno, col_offset):
+        """
+        The offset in the code of an AST position
+        """
+        return self._line_offsets[lineno - 1] + max(col_offset, 0)
+
+    def code_end(self, lineno):
+        """
+        The offset the code ends at, comments and blank lines aside. Only the code from lineno, the line of a top level
+        statement, is tokenized
+        """
+        end = None
+        try:
+            for token_type, _, _, token_end, _ in tokenize.generate_tokens(StringIO(self.code[self.offset(lineno, 0):])
+                                                                            .readline):
+                if token_type not in _SKIPPED and token_type not in _ENDS:
+                    end = token_end
+        except (tokenize.TokenError, IndentationError):     # lineno isn't where the statement starts
+            return len(self.code)
+        return self.offset(lineno, 0) if end is None else self.offset(lineno + end[0] - 1, end[1])
+
+    def statement(self, node):
+        """
+        The text of a simple statement, None if its position isn't known
+        """
+        text = self._rest_of_line(node)
+        if text is None or _NEEDS_TOKENS.search(text) or not _balanced(text):
+            text = self._text(node, False)
+        return text
+
+    def header(self, node):
+        """
+        The header of an if or while statement up to its colon, an elif as an if. None if its position isn't known
+        """
+        text = self._rest_of_line(node)
+        if text is None or _NEEDS_TOKENS.search(text) or not _balanced(text) or not text.endswith(':'):
+            text = self._text(node, True)
+        start = self._line_offsets[node.lineno - 1]
+        if text is not None and self.code[start:start + node.col_offset].strip() == 'elif':   # elif starts at its test
+            text = 'if ' + text
+        return text
+
+    def _rest_of_line(self, node):
+        if node.col_offset < 0:     # A multiline string, positioned at its last line
+            return None
+        start = self.offset(node.lineno, node.col_offset)
+        end = self.code.find('\n', start)
+        return self.code[start:end if end != -1 else len(self.code)].rstrip()
+
+    def _text(self, node, header):
+        if self._tokens is None:
+            self._tokenize()
+        index = self._token_at.get((node.lineno, node.col_offset))
+        if index is None:
+            return None
+        depth = 0
+        lambdas = 0     # Lambdas out of brackets, each takes a colon
+        end = None
+        tokens = self._tokens
+        for position in xrange(index, len(tokens)):
+            token_type, string, _, token_end, _ = tokens[position]
+            if token_type in _ENDS:
+                break
+            if token_type in _SKIPPED:
+                continue
+            if token_type == tokenize.OP:
+                if string in _OPENING:
+                    depth += 1
+                elif string in _CLOSING:
+                    depth -= 1
+                elif depth == 0 and string == ';' and not header:
+                    break
+                elif depth == 0 and string == ':' and header:
+                    if not lambdas:
+                        end = token_end
+                        break
+                    lambdas -= 1
+            elif token_type == tokenize.NAME and string == 'lambda' and depth == 0:
+                lambdas += 1
+            end = token_end
+        return self.code[self.offset(node.lineno, node.col_offset):self.offset(*end)]
+
+    def _tokenize(self):
+        try:
+            self._tokens = list(tokenize.generate_tokens(StringIO(self.code).readline))
+        except (tokenize.TokenError, IndentationError):
+            self._tokens = []
+        self._token_at = {}
+        for index, token in enumerate(self._tokens):
+            if token[0] not in _SKIPPED:
+                self._token_at[token[2]] = index
+
+
+def _balanced(text):
+    return text.count('(') == text.count(')') and text.count('[') == text.count(']') and \
+        text.count('{') == text.count('}')
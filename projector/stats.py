@@ -0,0 +1,112 @@
+import functools
+import time
+
+
+class Stats(object):
+    """
+    The time spent in every phase and the number of times it was entered. Disabled by default, when timing a phase
+    costs a flag check. A phase entered again inside itself (recursive blocks, aliases inside attributes) is timed only
+    once, and phases named 'a.b' are part of phase 'a'
+    """
+    def __init__(self):
+        self.enabled = False
+        self.seconds = {}
+        self.calls = {}
+        self._depth = {}
+        self._order = []    # The top level phases, in the order they were first timed
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self._depth.clear()
+        del self._order[:]
+
+    def phase(self, name):
+        return _Phase(self, name) if self.enabled else _NO_PHASE
+
+    def add(self, name, seconds):
+        top_level = name.split('.', 1)[0]
+        if top_level not in self._order:
+            self._order.append(top_level)
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def enter(self, name):
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        return time.time() if depth == 0 else None
+
+    def exit(self, name, started):
+        self._depth[name] -= 1
+        self.add(name, 0.0 if started is None else time.time() - started)
+
+    def report(self):
+        """
+        Lines of the phases in the order they started, every phase followed by its parts
+        """
+        lines = []
+        for name in sorted(self.seconds, key=lambda name: (self._order.index(name.split('.', 1)[0]), name)):
+            lines.append('%-30s %10.4fs %10d calls' % ('  ' * name.count('.') + name.rsplit('.', 1)[-1],
+                                                         self.seconds[name], self.calls[name]))
+        return lines
+
+
+class _Phase(object):
+    __slots__ = ('stats', 'name', 'started')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.started = self.stats.enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.stats.exit(self.name, self.started)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+STATS = Stats()
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as phase name when STATS is enabled
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if not STATS.enabled:
+                return function(*args, **kwargs)
+            started = STATS.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                STATS.exit(name, started)
+        return timed_function
+    return decorator
+
+
+def graph_metrics(graph):
+    """
+    (metric, value) of the size of a built graph
+    """
+    nodes = graph.nodes
+    alias_sets = [len(variables) for variables in graph.points_to.object_to_var.itervalues()]
+    return [('nodes', len(nodes)),
+            ('control edges', len(graph.control_edges)),
+            ('dependency edges', len(graph.ssa_edges)),
+            ('phi nodes', nodes.phis),
+            ('symbols', len(graph.symbols)),
+            ('objects', len(alias_sets)),
+            ('largest alias set', max(alias_sets) if alias_sets else 0),
+            ('mean alias set', round(float(sum(alias_sets)) / len(alias_sets), 2) if alias_sets else 0.0),
+            ('nesting depth', max(nodes.indent(index) for index in xrange(len(nodes))) if len(nodes) else 0)]
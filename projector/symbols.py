@@ -0,0 +1,85 @@
+from array import array
+
+
+class SymbolTable(object):
+    """
+    Interns variables and their attributes (x, x.a) to small ints, shared by every builder of a graph.
+    An attribute symbol knows its base variable and every variable knows its attribute symbols
+    """
+    def __init__(self):
+        self._variables = {}
+        self._attributes = {}
+        self._attributes_of = {}
+        self._names = []
+        self._bases = array('l')
+
+    def __getstate__(self):
+        return self._names, self._bases.tostring()
+
+    def __setstate__(self, state):
+        names, bases = state
+        self.__init__()
+        bases = array('l', bases)
+        for symbol, name in enumerate(names):
+            if bases[symbol] == symbol:
+                self.variable(name)
+            else:
+                self.attribute(bases[symbol], name[len(names[bases[symbol]]) + 1:])
+
+    def __len__(self):
+        return len(self._names)
+
+    def variable(self, name):
+        symbol = self._variables.get(name)
+        if symbol is None:
+            symbol = self._variables[name] = self._add(name, None)
+        return symbol
+
+    def attribute(self, base, attribute):
+        symbol = self._attributes.get((base, attribute))
+        if symbol is None:
+            symbol = self._attributes[(base, attribute)] = self._add(self._names[base] + '#' + attribute, base)
+            self._attributes_of.setdefault(base, []).append(symbol)
+        return symbol
+
+    def find_variable(self, name):
+        return self._variables.get(name)
+
+    def find_attribute(self, base, attribute):
+        return self._attributes.get((base, attribute))
+
+    def base(self, symbol):
+        return self._bases[symbol]
+
+    def is_attribute(self, symbol):
+        return self._bases[symbol] != symbol
+
+    def attributes(self, base):
+        return self._attributes_of.get(base, ())
+
+    def name(self, symbol):
+        return self._names[symbol]
+
+    def checkpoint(self):
+        return len(self._names)
+
+    def rollback(self, checkpoint):
+        """
+        Forget the symbols interned after checkpoint
+        """
+        for symbol in xrange(len(self._names) - 1, checkpoint - 1, -1):
+            base = self._bases[symbol]
+            if base == symbol:
+                del self._variables[self._names[symbol]]
+                self._attributes_of.pop(symbol, None)
+            else:
+                del self._attributes[(base, self._names[symbol][len(self._names[base]) + 1:])]
+                self._attributes_of[base].pop()
+        del self._names[checkpoint:]
+        del self._bases[checkpoint:]
+
+    def _add(self, name, base):
+        symbol = len(self._names)
+        self._names.append(name)
+        self._bases.append(symbol if base is None else base)
+        return symbol
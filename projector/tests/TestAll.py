@@ -1,8 +1,23 @@
+import ast
+import json
+import os
 import sys
+import time
 
 sys.path.insert(0, '../projector')
 import pytest
-from projector.projector import create_graph, Edge, create_projected_variable_path
+from projector.reachability import ReachabilityIndex, to_bitset, iter_bits
+from projector.symbols import SymbolTable
+from projector.session import AnalysisSession
+from projector.cache import GraphCache
+from projector.corpus import find_jobs, analyse_corpus
+from projector.server import SlicingServer
+from projector.benchmark import generate_program, run_case, regressions, PHASES
+from projector.stats import STATS, graph_metrics
+from projector.graph_utils import visualize, visualize_edges, straight_line_runs
+from projector.projector import create_graph, Edge, EdgeSet, StatementNode, ControlNode, create_projected_variable_path, project_many, \
+    project_variable, output_jsonl, output_results, create_graph_from_file, project_all, forward_slice, \
+    forward_project_variable, chop, with_controllers, run, watch
 
 code_1 = """
 x = 5
@@ -640,6 +655,42 @@ dep_edges_34 = [Edge(x, y) for x, y in [(0, 1), (0, 2), (1, 3), (3, 4), (2, 4)]]
 
 parameters_34 = []
 
+code_35 = """
+x = 1
+if x > 0:
+    while x < 5:
+        x = x + 1
+    y = d
+    z = d
+x
+"""
+
+control_edges_35 = [Edge(x, y) for x, y in [(0, 1), (1, 2), (1, 6), (2, 3), (2, 4), (3, 2), (4, 5), (5, 6), (6, 7)]]
+dep_edges_35 = [Edge(x, y) for x, y in [(0, 1), (0, 2), (0, 3), (0, 6), (3, 2), (3, 3), (3, 6)]]
+
+parameters_35 = [
+    ("x", [0, 1, 2, 3]),
+    ("z", [0, 1, 5]),
+]
+
+code_36 = """
+a = 1
+if a > 0:
+    b = 2
+c = 3
+if c > a:
+    b = c
+"""
+
+control_edges_36 = [Edge(x, y) for x, y in [(0, 1), (1, 2), (1, 3), (2, 3), (3, 4), (4, 5), (4, 6), (5, 6)]]
+dep_edges_36 = [Edge(x, y) for x, y in [(0, 1), (0, 4), (3, 4), (3, 5)]]
+
+parameters_36 = [
+    ("a", [0]),
+    ("b", [0, 1, 2, 3, 4, 5]),
+    ("c", [3]),
+]
+
 tests = [
     (code_1, control_edges_1, dep_edges_1, parameters_1),
     (code_2, control_edges_2, dep_edges_2, parameters_2),
@@ -675,6 +726,8 @@ tests = [
     (code_32, control_edges_32, dep_edges_32, parameters_32),
     (code_33, control_edges_33, dep_edges_33, parameters_33),
     (code_34, control_edges_34, dep_edges_34, parameters_34),
+    (code_35, control_edges_35, dep_edges_35, parameters_35),
+    (code_36, control_edges_36, dep_edges_36, parameters_36),
 ]
 
 
@@ -695,3 +748,441 @@ def test_var(code, control_edges, dep_edges, parameters):
     for val, deps in parameters:
         projection = create_projected_variable_path(code, val)
         compare_lists(projection, deps)
+
+
+@pytest.mark.parametrize("code, control_edges, dep_edges, parameters", tests, ids=[str(x+1) for x in xrange(len(tests))])
+def test_project_many(code, control_edges, dep_edges, parameters):
+    projections = project_many(code, [val for val, deps in parameters])
+    assert len(projections) == len(parameters)
+    for val, deps in parameters:
+        compare_lists(projections[val], deps)
+
+
+def test_edge_set():
+    edges = EdgeSet([Edge(0, 1), Edge(1, 2), Edge(0, 1), Edge(3, 2)])
+    assert len(edges) == 3
+    assert Edge(1, 2) in edges
+    assert edges.predecessors[2] == [1, 3]
+
+    assert edges.pointing_to(2) == [1, 3]
+    edges.redirect(3, 2, 1)
+    assert Edge(3, 2) not in edges
+    assert edges.successors[3] == [1]
+    assert sorted(edges.predecessors[1]) == [0, 3]
+
+
+def test_reachability_index():
+    index = ReachabilityIndex({1: [0, 2], 2: [1], 3: [2], 5: [3, 4]})
+    assert list(iter_bits(index.closure(3))) == [0, 1, 2, 3]
+    assert index.dependencies(5) == set([0, 1, 2, 3, 4, 5])
+    assert index.closure(4) == to_bitset([4])
+    assert index.closure_of([0, 4]) == to_bitset([0, 4])
+    assert list(iter_bits(to_bitset([0, 9, 64, 1000]))) == [0, 9, 64, 1000]
+
+
+def test_node_views():
+    nodes = create_graph(code_3).nodes
+    assert len(nodes) == 7
+    assert isinstance(nodes[2], ControlNode) and nodes[2].checked_vars == ['x']
+    assert nodes[4].statement == 'else:' and nodes[4].indent == 0
+    assert isinstance(nodes[-1], StatementNode)
+    assert nodes[-1].assigned_var == 't' and nodes[-1].influence_vars == set(['h', 'x'])
+    assert nodes.statement(3) == nodes[3].statement == 'h = x'
+    assert [node.indent for node in nodes] == [0, 0, 0, 1, 0, 1, 0]
+
+
+def test_symbol_table():
+    symbols = SymbolTable()
+    x = symbols.variable('x')
+    x_a = symbols.attribute(x, 'a')
+    assert symbols.variable('x') == x and symbols.attribute(x, 'a') == x_a
+    assert symbols.name(x_a) == 'x#a' and symbols.base(x_a) == x
+    assert symbols.is_attribute(x_a) and not symbols.is_attribute(x)
+    assert list(symbols.attributes(x)) == [x_a]
+    assert symbols.find_variable('y') is None and symbols.find_attribute(x, 'b') is None
+    assert len(symbols) == 2
+
+
+def test_points_to_merge_resolves_before_the_block():
+    graph = create_graph("if x > 1:\n    a = b\n    b = y\n")
+    symbols = graph.symbols
+    a, b, y = symbols.variable('a'), symbols.variable('b'), symbols.variable('y')
+    assert graph.points_to.aliases(y) == [b]
+    assert graph.points_to.aliases(b) == [a]
+
+
+@pytest.mark.parametrize("old_code, new_code", [
+    (code_3, code_3.replace("t = h", "t = x")),
+    (code_35, code_36),
+    (code_36, code_36 + "a = c\n"),
+    (code_36, code_36.split("if")[0]),
+])
+def test_session_update(old_code, new_code):
+    session = AnalysisSession(checkpoint_interval=1)
+    session.update(old_code)
+    session.project_many(['a', 'b', 'c'])
+    graph = session.update(new_code)
+    fresh = create_graph(new_code)
+    assert list(graph.dep_edges.pairs()) == list(fresh.dep_edges.pairs())
+    assert list(graph.control_edges.pairs()) == list(fresh.control_edges.pairs())
+    assert [str(node) for node in graph.nodes] == [str(node) for node in fresh.nodes]
+    assert session.project_many(['a', 'b', 'c', 'x']) == project_many(new_code, ['a', 'b', 'c', 'x'])
+
+
+def test_session_update_after_failed_update():
+    lines = ['a = 1', 'b = 2'] + ['z%d = %d' % (index, index) for index in xrange(2, 50)]
+    lines[20] = 'd = b'
+    session = AnalysisSession()
+    session.update('\n'.join(lines) + '\n')
+    broken = list(lines)
+    broken[1] = 'b = a'
+    broken[20] = 'if b:\n    d = b'    # A condition the builder doesn't support
+    with pytest.raises(AttributeError):
+        session.update('\n'.join(broken) + '\n')
+    lines[30] = 'z30 = 31'
+    code = '\n'.join(lines) + '\n'
+    graph = session.update(code)
+    assert [str(node) for node in graph.nodes] == [str(node) for node in create_graph(code).nodes]
+    assert session.project('d') == project_variable(create_graph(code), 'd') == [1, 20]
+
+
+def test_session_memory_stays_close_to_a_fresh_build():
+    code = generate_program(2000, depth=2, alias_density=0.5, variables=20, seed=1)
+    session = AnalysisSession()
+    graph = session.update(code)
+    assert 0 < graph.points_to.undo_size() <= graph.points_to.size()
+    assert session._checkpoints[0][0] > 0
+    lines = code.split('\n')
+    for edited in [['v0 = 1'] + lines[1:], lines[:-2] + ['v0 = v1', '']]:
+        edited = '\n'.join(edited)
+        graph = session.update(edited)
+        fresh = create_graph(edited)
+        assert list(graph.dep_edges.pairs()) == list(fresh.dep_edges.pairs())
+        assert graph.points_to.var_to_object == fresh.points_to.var_to_object
+        assert graph.points_to.undo_size() <= graph.points_to.size()
+
+
+def test_watch_skips_a_file_gone_for_a_moment(tmpdir, monkeypatch):
+    code_file = tmpdir.join('code.py')
+    code_file.write('x = 1\ny = x\n')
+    code_file.setmtime(1000)
+    steps = [code_file.remove, lambda: code_file.write('x = 2\ny = x\n')]
+
+    def sleep(seconds):
+        if not steps:
+            raise KeyboardInterrupt
+        steps.pop(0)()
+    monkeypatch.setattr(time, 'sleep', sleep)
+    with pytest.raises(KeyboardInterrupt):
+        watch(str(code_file), str(tmpdir), ['y'], graphs=False, analysis=False)
+    assert tmpdir.join('projected_code.py').read() == 'x = 2\ny = x\n'
+
+
+def test_session_reuses_unchanged_code():
+    session = AnalysisSession()
+    graph = session.update(code_36)
+    projection = session.project('b')
+    assert session.update(code_36 + "\n# comment\n") is graph
+    assert session.project('b') is projection
+
+
+def test_graph_cache(tmpdir):
+    cache = GraphCache(str(tmpdir))
+    built = cache.graph(code_35)
+    loaded = GraphCache(str(tmpdir)).load(code_35)
+    assert loaded is not built
+    assert list(loaded.dep_edges.pairs()) == list(built.dep_edges.pairs())
+    assert list(loaded.control_edges) == list(built.control_edges)
+    assert [str(node) for node in loaded.nodes] == [str(node) for node in built.nodes]
+    assert loaded.last_seen == built.last_seen
+    assert loaded.points_to.var_to_object == built.points_to.var_to_object
+    for var in ['x', 'y', 'z']:
+        assert project_variable(loaded, var) == project_variable(built, var)
+        assert forward_project_variable(loaded, var) == forward_project_variable(built, var)
+    assert cache.load(code_36) is None
+
+
+def test_graph_cache_eviction(tmpdir):
+    cache = GraphCache(str(tmpdir), max_bytes=1)
+    cache.graph(code_35)
+    cache.graph(code_36)
+    assert cache.load(code_35) is None
+
+
+def test_analyse_corpus(tmpdir):
+    corpus = tmpdir.mkdir('corpus')
+    corpus.join('first.py').write(code_3)
+    corpus.mkdir('inner').join('second.py').write(code_36)
+    corpus.join('broken.py').write('x = = 1\n')
+    jobs = find_jobs(str(corpus), ['h'])
+    assert [name for _, name, _ in jobs] == ['broken.py', 'first.py', 'inner/second.py']
+
+    output = tmpdir.join('output')
+    results = dict(analyse_corpus(jobs, str(output), processes=2))
+    assert results[str(corpus.join('first.py'))] is None
+    assert results[str(corpus.join('inner', 'second.py'))] is None
+    assert 'SyntaxError' in results[str(corpus.join('broken.py'))]
+    assert output.join('first', 'projected_code.py').read() == 'x = 5\ny = 6\nif x > 4:\n\th = x\nelse:\n\th = y\n'
+    assert output.join('inner', 'second', 'analysis_result.txt').check()
+
+
+def test_output_jsonl(tmpdir):
+    graph = create_graph(code_3)
+    output_jsonl(graph, lambda var: project_variable(graph, var), ['h', 't'], str(tmpdir))
+    records = [json.loads(line) for line in tmpdir.join('analysis_result.jsonl').readlines()]
+    nodes = [record for record in records if record['type'] == 'node']
+    assert [node['statement'] for node in nodes] == [node.statement for node in graph.nodes]
+    assert nodes[3] == {'type': 'node', 'line': 3, 'kind': 'statement', 'indent': 1, 'statement': 'h = x',
+                        'assigned_var': 'h', 'variables': ['x']}
+    assert nodes[4]['kind'] == 'else' and nodes[4]['assigned_var'] is None
+    assert [(record['from'], record['to']) for record in records if record['type'] == 'dep_edge'] == \
+        list(graph.dep_edges.pairs())
+    assert len([record for record in records if record['type'] == 'control_edge']) == len(graph.control_edges)
+    assert [(record['variable'], record['lines']) for record in records if record['type'] == 'projection'] == \
+        [('h', [0, 1, 2, 3, 4, 5]), ('t', [0, 1, 2, 3, 4, 5, 6])]
+
+
+def test_visualize_without_neato(tmpdir, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmpdir))
+    out_path = str(tmpdir.join('out.gv'))
+    assert visualize(create_graph(code_3), out_path, render=True) == []
+    assert tmpdir.join('out.gv_control').check() and tmpdir.join('out.gv_dep').check()
+    assert not visualize_edges(create_graph(code_3), out_path + '_all', True, True)
+    assert visualize_edges(create_graph(code_36), out_path + '_all', True, True)
+
+
+def test_visualize_edges_writes_every_node_once(tmpdir):
+    out_file = str(tmpdir.join('out.gv'))
+    visualize_edges(create_graph(code_3), out_file, True, True)
+    lines = tmpdir.join('out.gv').readlines()
+    assert lines[0] == '// Graph\n' and lines[-1] == '}\n'
+    node_lines = [line for line in lines if '[label=' in line]
+    assert len(node_lines) == 6 and '\t3 [label="h = x" pos="50,200"]\n' in node_lines
+    assert '\t2 -> 3 [color=blue]\n' in lines and '\t0 -> 2 [color=green style=dashed]\n' in lines
+
+
+def test_visualize_large_graph(tmpdir):
+    graph = create_graph(code_36)
+    assert straight_line_runs(graph) == [0, 1, 2, 3, 4, 5]
+    graph = create_graph(code_1)
+    assert straight_line_runs(graph) == [0] * 11
+
+    out_path = str(tmpdir.join('out.gv'))
+    visualize(graph, out_path, max_nodes=5)
+    assert [line for line in tmpdir.join('out.gv_all').readlines() if '[label=' in line] == \
+        ['\t0 [label="x = 5\\n... 9 statements ...\\nd=c*b" pos="0,550"]\n']
+    visualize(graph, out_path, max_nodes=5, focus=[7, 8, 9])
+    assert [line.split(' ')[0] for line in tmpdir.join('out.gv_dep').readlines() if '[label=' in line] == \
+        ['\t7', '\t8', '\t9']
+
+
+def test_slicing_server(tmpdir):
+    server = SlicingServer(max_files=1)
+    code_file = tmpdir.join('code.py')
+    code_file.write(code_3)
+    request = '{"jsonrpc": "2.0", "id": 7, "method": "project", "params": {"file": "%s", "var": "h"}}' % code_file
+    assert json.loads(server.handle(request)) == {'jsonrpc': '2.0', 'id': 7, 'result': [0, 1, 2, 3, 4, 5]}
+    assert server._files[str(code_file)].session._checkpoints == []    # Built as create_graph does until edited
+    code_file.write(code_3.replace('h = y', 'h = 3'))
+    assert json.loads(server.handle(request))['result'] == [0, 2, 3, 4, 5]
+    assert server._files[str(code_file)].session._checkpoints
+
+    response = json.loads(server.handle('{"id": 1, "method": "analysis", "params": ["other.py", "a = 1\\nb = a\\n"]}'))
+    assert [node['statement'] for node in response['result']['nodes']] == ['a = 1', 'b = a']
+    assert response['result']['dep_edges'] == [{'from': 0, 'to': 1}]
+    assert len(server._files) == 1
+
+    # Files that can't be read or analysed are not kept, nor evict the warm one
+    assert json.loads(server.handle(request.replace('code.py', 'missing.py')))['error']['code'] == -32000
+    assert server._files.keys() == [os.path.abspath('other.py')]
+    failing = '{"id": 4, "method": "analysis", "params": ["other.py", "a = 1\\nif a:\\n    b = 1\\n"]}'
+    assert json.loads(server.handle(failing))['error']['code'] == -32000
+    response = json.loads(server.handle('{"id": 5, "method": "analysis", "params": ["other.py", "a = 1\\nc = a\\n"]}'))
+    assert [node['statement'] for node in response['result']['nodes']] == ['a = 1', 'c = a']
+
+    assert json.loads(server.handle('{"id": 2, "method": "slice"}'))['error']['code'] == -32601
+    assert json.loads(server.handle('{"id": 3, "method": "project", "params": {"file": "x.py", "code": "x = = 1", '
+                                    '"var": "x"}}'))['error']['code'] == -32000
+    for params in ['{"file": "x.py", "code": "x = 1"}', '{"file": "x.py", "code": "x = 1", "var": "x", "variables": []}',
+                   '"oops"', '{"file": "x.py", "bad": 1}', '[]', '{"f\\u00e9": 1}']:
+        response = json.loads(server.handle('{"id": 3, "method": "project", "params": %s}' % params))
+        assert response['error']['code'] == -32602
+    response = json.loads(server.handle('{"id": 3, "method": "project", "params": ["x.py", 5, null, "x = 1"]}'))
+    assert response['error']['code'] == -32000
+    assert json.loads(server.handle('not json'))['error']['code'] == -32700
+    assert server.handle('{"method": "analysis", "params": ["other.py", "a = 1"]}') is None
+
+
+def test_benchmark():
+    code = generate_program(50, depth=2, alias_density=0.5, variables=5, seed=3)
+    assert code == generate_program(50, depth=2, alias_density=0.5, variables=5, seed=3)
+    assert len(create_graph(code).nodes) == 50
+    assert 'Obj()' in code and '    ' in code
+
+    phases = run_case(50, 2, 0.5, 5, repeat=1)
+    assert sorted(phases) == sorted(PHASES)
+    baseline = {'cases': {'case': {'phases': phases}}}
+    slower = dict((phase, {'seconds': result['seconds'] * 2 + 1}) for phase, result in phases.items())
+    assert regressions(baseline, baseline) == []
+    assert [phase for _, phase, _, _ in regressions({'cases': {'case': {'phases': slower}}}, baseline)] == PHASES
+
+
+def test_stats():
+    STATS.reset()
+    create_graph(code_3)
+    assert STATS.seconds == {}
+    STATS.enabled = True
+    try:
+        graph = create_graph(code_3)
+        project_variable(graph, 'h')
+    finally:
+        STATS.enabled = False
+    assert STATS.calls['parse'] == STATS.calls['build'] == STATS.calls['project'] == 1
+    assert STATS.calls['build.inner_blocks'] == 2
+    assert [line.split()[0] for line in STATS.report()][:2] == ['parse', 'build']
+    metrics = dict(graph_metrics(graph))
+    assert metrics['nodes'] == len(graph.nodes) and metrics['nesting depth'] == 1
+    STATS.reset()
+
+
+def test_slice_only_output(tmpdir):
+    graph = create_graph(code_3)
+    output_results(graph, lambda var: project_variable(graph, var), ['h'], str(tmpdir), graphs=False, analysis=False)
+    assert [path.basename for path in tmpdir.listdir()] == ['projected_code.py']
+    output_results(graph, lambda var: project_variable(graph, var), ['h'], str(tmpdir), graphs=False, analysis=False,
+                   output_format='jsonl')
+    assert [json.loads(line)['type'] for line in tmpdir.join('analysis_result.jsonl').readlines()] == ['projection']
+
+
+@pytest.mark.parametrize("code, control_edges, dep_edges, parameters", tests, ids=[str(x+1) for x in xrange(len(tests))])
+def test_project_all(code, control_edges, dep_edges, parameters):
+    graph = create_graph(code)
+    slices = project_all(graph)
+    assert slices.variables == sorted(set(slices.variables), key=slices.variables.index)
+    assert set(slices.variables) == set(node.assigned_var for node in graph.nodes
+                                        if isinstance(node, StatementNode) and node.assigned_var and
+                                        '#' not in node.assigned_var)
+    for variable in slices.variables:
+        assert slices.lines(variable) == project_variable(graph, variable)
+        assert all((variable, line) in slices for line in slices.lines(variable))
+
+
+def test_queries_leave_the_symbols_alone():
+    graph = create_graph(code_3)
+    symbols = len(graph.symbols)
+    for query in ['typo%d' % index for index in xrange(100)] + ['typo.a', 'typo + 1']:
+        assert project_variable(graph, query) == []
+    assert project_variable(graph, 'h + typo') == project_variable(graph, 'h')
+    project_variable(graph, 'h.typo')
+    assert len(graph.symbols) == symbols
+
+
+def test_forward_slice_and_chop():
+    graph = create_graph('x = 1\ny = 2\nz = x + 1\nif z > 1:\n    w = 5\nq = y\n')
+    assert forward_project_variable(graph, 'x') == [0, 2, 3, 4]
+    assert forward_slice(graph, [1]) == [1, 5]
+    assert forward_project_variable(graph, 'nothing') == []
+    assert chop(graph, 'x', 'w') == [0, 2, 3, 4]
+    assert chop(graph, 'y', 'w') == []
+
+    for code in [code_9, code_22, code_28, code_35]:
+        graph = create_graph(code)
+        forward = [forward_slice(graph, [line]) for line in xrange(len(graph.nodes))]
+        for line in xrange(len(graph.nodes)):
+            backward = graph.dependence.dependencies(line)
+            assert backward == set(other for other in xrange(len(graph.nodes)) if line in forward[other])
+        dependence = graph.dependence
+        graph.forget_closures()
+        assert graph.dependence is not dependence
+        assert [graph.dependence.closure(line) for line in xrange(len(graph.nodes))] == \
+            [dependence.closure(line) for line in xrange(len(graph.nodes))]
+        for source in project_all(graph).variables:
+            for target in project_all(graph).variables:
+                assert chop(graph, source, target) == \
+                    sorted(set(forward_project_variable(graph, source)) & set(project_variable(graph, target)))
+
+
+def test_forward_and_chop_code_output(tmpdir):
+    code_file = tmpdir.join('code.py')
+    code_file.write('x = 1\nc = 2\nif c > 0:\n    y = x\nt = y')
+    graph = create_graph(code_file.read())
+    assert chop(graph, 'x', 't') == [0, 3, 4]
+    assert with_controllers(graph, chop(graph, 'x', 't')) == [0, 2, 3, 4]
+    for options in [{'forward': '', 'slice-only': ''}, {'chop': 'x', 'slice-only': ''}]:
+        run([str(code_file), str(tmpdir), 'x' if 'forward' in options else 't'], options)
+        assert tmpdir.join('projected_code.py').read() == 'x = 1\nif c > 0:\n\ty = x\nt = y\n'
+
+    code_file.write('x = 1\nif x > 0:\n    y = 1\nelse:\n    y = 2\nz = y')
+    run([str(code_file), str(tmpdir), '4'], {'forward': '', 'slice-only': ''})
+    assert tmpdir.join('projected_code.py').read() == 'if x > 0:\n\tpass\nelse:\n\ty = 2\nz = y\n'
+    ast.parse(tmpdir.join('projected_code.py').read())
+    run([str(code_file), str(tmpdir), '4'], {'forward': '', 'slice-only': '', 'format': 'jsonl'})
+    assert json.loads(tmpdir.join('analysis_result.jsonl').read())['lines'] == [4, 5]
+    with pytest.raises(RuntimeError):
+        run([str(code_file), str(tmpdir), '42'], {'forward': ''})
+
+
+def test_assigning_after_rollback():
+    session = AnalysisSession(checkpoint_interval=1)
+    session.update('x = 1\ny = x\nx = y\nz = x\n')
+    graph = session.update('x = 1\ny = x\nz = y\nx = z\nx = 3\n')
+    symbols = graph.symbols
+    assert graph.nodes.assigning([symbols.variable('x')]) == [0, 3, 4]
+    assert graph.nodes.assigning([symbols.variable('z'), symbols.variable('y')]) == [1, 2]
+    assert forward_project_variable(graph, 'z') == [2, 3]
+
+def test_statement_text_keeps_formatting():
+    code = 'x=5  # five\nif x<3:\n    y = x+1 ; z = (y *\n        2)\nelif x > y :  # c\n    f = lambda q: q\n'
+    graph = create_graph(code)
+    assert [graph.nodes.statement(i) for i in xrange(len(graph.nodes))] == \
+        ['x=5', 'if x<3:', 'y = x+1', 'z = (y *\n        2)', 'else:', 'if x > y :', 'f = lambda q: q']
+
+    session = AnalysisSession()
+    session.update(code)
+    session.update(code.replace('x=5', 'x = 5'))
+    assert session.graph.nodes.statement(0) == 'x = 5'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 20, 1000])
+def test_create_graph_from_file(tmpdir, chunk_size):
+    code = '"""\nx = 1\n"""\n' + code_36 + '\nif x > 1:\n    a = (b +\nx)\nelse:\n    a = 2\n' + code_3
+    code_file = tmpdir.join('code.py')
+    code_file.write(code)
+    graph, last_line = create_graph_from_file(str(code_file), chunk_size)
+    fresh = create_graph(code)
+    assert last_line == code.rsplit('\n', 1)[-1]
+    assert list(graph.dep_edges.pairs()) == list(fresh.dep_edges.pairs())
+    assert [str(node) for node in graph.nodes] == [str(node) for node in fresh.nodes]
+    assert project_variable(graph, 'h') == project_variable(fresh, 'h')
+
+    code_file.write('')
+    assert len(create_graph_from_file(str(code_file))[0].nodes) == 0
+
+
+def test_deeply_nested_while():
+    depth = 30
+    code = ''.join('    ' * level + 'while x < y:\n' for level in xrange(depth))
+    code += '    ' * depth + 'b = x + q\n' + '    ' * depth + 'q = y\n'
+    graph = create_graph(code)
+    assert Edge(depth + 1, depth) in graph.dep_edges    # q from the previous iteration
+    assert sorted(len(lines) for lines in graph.unknown_vars.itervalues()) == [1, depth + 1, depth + 1]
+
+
+def test_phi_nodes():
+    branches = 50
+    code = 'x = 0\n' + ''.join('if c > 0:\n    x = %d\n' % index for index in xrange(branches)) + 'y = x\n'
+    graph = create_graph(code)
+    phi = graph.last_seen[graph.symbols.variable('x')]
+    assert phi < 0 and graph.nodes.phis == branches
+    assert graph.ssa_edges.pointing_to(2 * branches + 1) == [phi]
+    assert len(graph.ssa_edges) == 2 * branches + 1
+    uses = [edge.from_ for edge in graph.dep_edges if edge.to == 2 * branches + 1]
+    assert uses == range(0, 2 * branches + 1, 2)
+    assert create_projected_variable_path(code, 'y') == range(2 * branches + 2)
+
+    code = 'x = 0\nwhile x < 5:\n    y = x\n    x = y + 1\nz = x\n'
+    graph = create_graph(code)
+    head = graph.last_seen[graph.symbols.variable('x')]
+    assert sorted(graph.ssa_edges.pointing_to(head)) == [0, 3]
+    assert [graph.ssa_edges.pointing_to(use) for use in (1, 2, 4)] == [[head]] * 3
+    assert set(Edge(definition, use) for definition in (0, 3) for use in (1, 2, 4)) <= set(graph.dep_edges)